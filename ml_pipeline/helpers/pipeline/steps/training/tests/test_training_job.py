@@ -11,7 +11,15 @@
 
 Description: Tests for ml_pipeline.helpers.pipeline.step.training.training_job.py
 """
-from ml_pipeline.helpers.pipeline.steps.training.training_job import create_estimator
+import pytest
+from sagemaker.workflow.pipeline_context import PipelineSession
+
+from ml_pipeline.helpers.pipeline.steps.training.training_job import (
+    create_estimator,
+    create_training_input,
+    create_training_step,
+    get_output_file_count
+)
 
 
 def test_create_estimator_returns_expected_objects():
@@ -25,4 +33,78 @@ def test_create_estimator_returns_expected_objects():
     )
 
     assert estimator.entry_point == "test_entry_point"
-    assert estimator.source_dir == "entry_point_dir"
\ No newline at end of file
+    assert estimator.source_dir == "entry_point_dir"
+
+
+def test_create_training_input_returns_expected_objects():
+    training_input = create_training_input(
+        s3_data="s3a://bucket/data_output",
+        input_mode="FastFile",
+        distribution="ShardedByS3Key"
+    )
+    s3_data_source = training_input.config["DataSource"]["S3DataSource"]
+
+    assert s3_data_source["S3Uri"] == "s3://bucket/data_output"
+    assert s3_data_source["S3DataDistributionType"] == "ShardedByS3Key"
+    assert training_input.config["InputMode"] == "FastFile"
+    assert training_input.config["ContentType"] == "application/x-parquet"
+
+
+def test_create_training_input_invalid_input_mode_raises():
+    with pytest.raises(ValueError):
+        create_training_input(s3_data="s3://bucket/data_output", input_mode="Stream")
+
+
+def test_create_training_input_pipe_mode_requires_streamable_content():
+    with pytest.raises(ValueError):
+        create_training_input(s3_data="s3://bucket/data_output", input_mode="Pipe")
+
+    training_input = create_training_input(s3_data="s3://bucket/data_output", input_mode="Pipe", content_type="text/csv")
+    assert training_input.config["InputMode"] == "Pipe"
+
+
+def test_create_estimator_sklearn_distributed_training_raises():
+    with pytest.raises(ValueError, match="distributed training"):
+        create_estimator(
+            estimator_name="estimator_test",
+            estimator_entry_point="test_entry_point",
+            estimator_code_dir="entry_point_dir",
+            role="role_arn",
+            instance_type="type1",
+            instance_count=2
+        )
+
+
+def test_create_training_step_returns_expected_objects():
+    estimator = create_estimator(
+        estimator_name="estimator_test",
+        estimator_entry_point="train.py",
+        estimator_code_dir="s3://bucket/code/sourcedir.tar.gz",
+        role="arn:aws:iam::111111111111:role/role_name",
+        instance_type="ml.m5.xlarge",
+        instance_count=2,
+        framework_version="1.5-1",
+        sagemaker_session=PipelineSession(default_bucket="bucket"),
+        estimator_type="xgboost"
+    )
+    estimator.output_path = "s3://bucket/model"
+
+    step = create_training_step(
+        step_name="training_test",
+        estimator=estimator,
+        processing_step="processing_test",
+        training_data_uri="s3a://bucket/data_output"
+    )
+    channel = step.arguments["InputDataConfig"][0]
+
+    assert step.depends_on == ["processing_test"]
+    assert step.arguments["ResourceConfig"]["InstanceCount"] == 2
+    assert channel["ChannelName"] == "train"
+    assert channel["InputMode"] == "FastFile"
+    assert channel["DataSource"]["S3DataSource"]["S3Uri"] == "s3://bucket/data_output"
+    assert channel["DataSource"]["S3DataSource"]["S3DataDistributionType"] == "ShardedByS3Key"
+
+
+def test_get_output_file_count_aligns_with_instance_count():
+    assert get_output_file_count(instance_count=4) == 4
+    assert get_output_file_count(instance_count=4, files_per_instance=3) == 12
@@ -11,12 +11,19 @@
 
 Description: Helper functions to handle SageMaker Training Jobs
 """
+from sagemaker.inputs import TrainingInput
+from sagemaker.workflow.steps import TrainingStep
 from sagemaker.sklearn import SKLearn
 from sagemaker.mxnet import MXNet
 from sagemaker.pytorch import PyTorch
 from sagemaker.tensorflow import TensorFlow
 from sagemaker.xgboost import XGBoost
 
+TRAINING_INPUT_MODES = ["File", "FastFile", "Pipe"]
+S3_DATA_DISTRIBUTION_TYPES = ["FullyReplicated", "ShardedByS3Key"]
+# parquet readers seek to the footer of every file, so parquet data cannot be streamed through a Pipe fifo
+SEEKABLE_CONTENT_TYPES = ["application/x-parquet"]
+
 
 def create_estimator(estimator_name, estimator_entry_point, estimator_code_dir, role, instance_type, instance_count=1,
                      framework_version="0.20.0", tags=None, subnets=None, security_group_ids=None,
@@ -69,6 +76,10 @@ def create_estimator(estimator_name, estimator_entry_point, estimator_code_dir,
     """
     # create a sklearn model. For more information:
     # https://sagemaker.readthedocs.io/en/stable/frameworks/sklearn/using_sklearn.html
+    if estimator_type == "sklearn" and instance_count > 1:
+        raise ValueError(f"Scikit-learn estimators do not support distributed training. Found instance_count "
+                         f"{instance_count}. Use instance_count = 1 or a distributed estimator type, e.g. xgboost")
+
     if estimator_type == "sklearn":
         estimator = SKLearn(
             base_job_name=estimator_name,
@@ -168,3 +179,93 @@ def create_estimator(estimator_name, estimator_entry_point, estimator_code_dir,
         supported_values = '["sklearn", "mxnet", "pytorch", "tensorflow", "xgboost"]'
         raise ValueError("Invalid estimator type. Supported values: " + supported_values)
     return estimator
+
+
+def get_output_file_count(instance_count, files_per_instance=1):
+    """
+    Get the number of files the processing step should write so that a ShardedByS3Key channel gives every
+    training instance the same number of files
+    Args:
+        instance_count (int): number of training instances
+        files_per_instance (int): number of files each training instance receives. Default 1
+    Returns:
+        (int): number of output files
+    """
+    if instance_count < 1 or files_per_instance < 1:
+        raise ValueError("instance_count and files_per_instance must be positive integers")
+    return instance_count * files_per_instance
+
+
+def create_training_input(s3_data, input_mode="FastFile", distribution="ShardedByS3Key",
+                          content_type="application/x-parquet"):
+    """
+    Create a training channel for data written by a processing step
+    Args:
+        s3_data (str or PipelineVariable): s3 prefix with the training data. s3a:// uris are converted to s3://
+        input_mode (str): how the data is made available to the training container. Allowed values:
+                          File (full copy before training starts), FastFile (files streamed on first read) or
+                          Pipe (data streamed through a fifo, not supported for parquet). Default FastFile
+        distribution (str): FullyReplicated (every instance gets all files) or ShardedByS3Key (every instance gets
+                            1/instance_count of the files). Default ShardedByS3Key
+        content_type (str): MIME type of the input data. Default application/x-parquet
+    Returns:
+        (sagemaker.inputs.TrainingInput): training channel
+    """
+    if input_mode not in TRAINING_INPUT_MODES:
+        raise ValueError(f"Invalid input_mode. Found {input_mode}. Supported values: {TRAINING_INPUT_MODES}")
+
+    if distribution not in S3_DATA_DISTRIBUTION_TYPES:
+        raise ValueError(f"Invalid distribution. Found {distribution}. Supported values: {S3_DATA_DISTRIBUTION_TYPES}")
+
+    if input_mode == "Pipe" and content_type in SEEKABLE_CONTENT_TYPES:
+        raise ValueError(f"Pipe input mode cannot stream {content_type} data, which needs seekable files. "
+                         f"Use File or FastFile")
+
+    if isinstance(s3_data, str) and s3_data.startswith("s3a://"):
+        s3_data = "s3://" + s3_data[len("s3a://"):]
+
+    return TrainingInput(
+        s3_data=s3_data,
+        distribution=distribution,
+        content_type=content_type,
+        s3_data_type="S3Prefix",
+        input_mode=input_mode
+    )
+
+
+def create_training_step(step_name, estimator, processing_step, training_data_uri, channel_name="train",
+                         input_mode="FastFile", distribution="ShardedByS3Key", content_type="application/x-parquet",
+                         cache_config=None):
+    """
+    Create a training step that consumes the output written by a processing step
+    Args:
+        step_name (str): name of the training step
+        estimator (sagemaker.estimator.EstimatorBase): estimator created with a PipelineSession, e.g. with
+                                                       create_estimator
+        processing_step (sagemaker.workflow.steps.ProcessingStep): step writing the training data
+        training_data_uri (str or PipelineVariable): s3 prefix where the processing step writes the training data
+        channel_name (str): name of the training channel. Default train
+        input_mode (str): channel input mode. See create_training_input
+        distribution (str): channel data distribution. See create_training_input
+        content_type (str): MIME type of the input data. Default application/x-parquet
+        cache_config (sagemaker.workflow.steps.CacheConfig): step cache configuration. Default None
+    Returns:
+        (sagemaker.workflow.steps.TrainingStep): training step running after the processing step
+    """
+    # with a PipelineSession, fit returns the training job arguments instead of starting the job
+    step_args = estimator.fit(
+        inputs={
+            channel_name: create_training_input(
+                s3_data=training_data_uri,
+                input_mode=input_mode,
+                distribution=distribution,
+                content_type=content_type
+            )
+        }
+    )
+    return TrainingStep(
+        name=step_name,
+        step_args=step_args,
+        cache_config=cache_config,
+        depends_on=[processing_step]
+    )
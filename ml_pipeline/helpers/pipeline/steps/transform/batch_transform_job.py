@@ -10,4 +10,126 @@
  limitations under the License.
 
 Description: Helper functions to handle SageMaker Batch Transform Jobs
-"""
\ No newline at end of file
+"""
+import math
+
+from sagemaker.transformer import Transformer
+from sagemaker.workflow.steps import TransformStep
+
+# SageMaker limit for max_payload and for max_payload * max_concurrent_transforms
+MAX_PAYLOAD_MB = 100
+BYTES_PER_MB = 1024 * 1024
+
+
+def get_transform_payload_config(avg_record_bytes, records_per_request=1000, instance_vcpus=None):
+    """
+    Get the batch transform payload settings from the measured size of an inference record.
+    The payload fits records_per_request records (and at least one record), and one request per vCPU is sent
+    concurrently, capped so that max_payload * max_concurrent_transforms stays within the SageMaker limit
+    Args:
+        avg_record_bytes (float): average size of an inference record (one csv line) in bytes,
+                                  e.g. as measured by data_utils.spark_save_inference_input
+        records_per_request (int): number of records to send on each MultiRecord request. Default 1000
+        instance_vcpus (int): number of vCPUs of the transform instance type. If None, SageMaker chooses the
+                              number of concurrent transforms
+    Returns:
+        (dict): max_payload in MB and max_concurrent_transforms
+    """
+    if avg_record_bytes <= 0:
+        raise ValueError(f"avg_record_bytes must be greater than 0. Found {avg_record_bytes}")
+
+    max_payload = math.ceil(avg_record_bytes * max(records_per_request, 1) / BYTES_PER_MB)
+    if max_payload > MAX_PAYLOAD_MB:
+        max_payload = max(MAX_PAYLOAD_MB, math.ceil(avg_record_bytes / BYTES_PER_MB))
+    if max_payload > MAX_PAYLOAD_MB:
+        raise ValueError(f"A single record of {avg_record_bytes} bytes exceeds the {MAX_PAYLOAD_MB}MB payload limit")
+
+    max_concurrent_transforms = None
+    if instance_vcpus is not None:
+        max_concurrent_transforms = max(1, min(instance_vcpus, MAX_PAYLOAD_MB // max_payload))
+
+    return {
+        "max_payload": max_payload,
+        "max_concurrent_transforms": max_concurrent_transforms
+    }
+
+
+def create_transformer(base_job_name, model_name, instance_type, output_path, instance_count=1, max_payload=6,
+                       max_concurrent_transforms=None, strategy="MultiRecord", accept="text/csv", tags=None,
+                       volume_kms_key=None, output_kms_key=None, sagemaker_session=None):
+    """
+    Create a transformer to run batch inference on a SageMaker model
+    Args:
+        base_job_name (str): prefix for the transform job name
+        model_name (str): name of the SageMaker model used for inference
+        instance_type (str): Type of EC2 instance to use for the transform job, for example, ‘ml.c4.xlarge’.
+        output_path (str): s3 location to store the results of the transform job
+        instance_count (int): The number of instances to run the transform job with. Defaults to 1.
+        max_payload (int): maximum size of a request payload in MB. See get_transform_payload_config. Default 6
+        max_concurrent_transforms (int): maximum number of concurrent requests sent to each instance.
+                                         See get_transform_payload_config. Default None
+        strategy (str): how records are batched into requests. Allowed values: MultiRecord or SingleRecord.
+                        Default MultiRecord
+        accept (str): MIME type of the inference output. Default text/csv
+        tags (list[dict]): List of tags to be passed to the transform job. Default: None
+        volume_kms_key (str): A KMS key for the transform volume.
+        output_kms_key(str): The KMS key id to encrypt the transform output.
+        sagemaker_session(sagemaker.session.Session): Session object which manages interactions with Amazon SageMaker
+                                                      APIs and any other AWS services needed. If not specified, the
+                                                      transformer creates one using the default AWS configuration chain.
+    Returns:
+        (sagemaker.transformer.Transformer): transformer
+    """
+    if strategy not in ["MultiRecord", "SingleRecord"]:
+        raise ValueError(f"Invalid strategy. Found {strategy}. Supported values: MultiRecord or SingleRecord")
+
+    return Transformer(
+        model_name=model_name,
+        instance_count=instance_count,
+        instance_type=instance_type,
+        strategy=strategy,
+        assemble_with="Line",
+        output_path=output_path,
+        output_kms_key=output_kms_key,
+        accept=accept,
+        max_concurrent_transforms=max_concurrent_transforms,
+        max_payload=max_payload,
+        tags=tags,
+        base_transform_job_name=base_job_name,
+        sagemaker_session=sagemaker_session,
+        volume_kms_key=volume_kms_key
+    )
+
+
+def create_transform_step(step_name, transformer, data, processing_step=None, content_type="text/csv",
+                          split_type="Line", cache_config=None):
+    """
+    Create a batch transform step that consumes the inference input written by a processing step
+    Args:
+        step_name (str): name of the transform step
+        transformer (sagemaker.transformer.Transformer): transformer created with a PipelineSession, e.g. with
+                                                         create_transformer
+        data (str or PipelineVariable): s3 prefix with the inference input. s3a:// uris are converted to s3://
+        processing_step (sagemaker.workflow.steps.ProcessingStep): step writing the inference input. Default None
+        content_type (str): MIME type of the inference input. Default text/csv
+        split_type (str): how input files are split into records. Default Line, so files are split on lines and
+                          packed into MultiRecord requests of up to max_payload
+        cache_config (sagemaker.workflow.steps.CacheConfig): step cache configuration. Default None
+    Returns:
+        (sagemaker.workflow.steps.TransformStep): transform step
+    """
+    if isinstance(data, str) and data.startswith("s3a://"):
+        data = "s3://" + data[len("s3a://"):]
+
+    # with a PipelineSession, transform returns the transform job arguments instead of starting the job
+    step_args = transformer.transform(
+        data=data,
+        content_type=content_type,
+        split_type=split_type
+    )
+    return TransformStep(
+        name=step_name,
+        step_args=step_args,
+        cache_config=cache_config,
+        depends_on=[processing_step] if processing_step is not None else None
+    )
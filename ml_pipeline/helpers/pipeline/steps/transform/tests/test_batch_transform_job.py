@@ -0,0 +1,89 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for ml_pipeline.helpers.pipeline.step.transform.batch_transform_job.py
+"""
+import pytest
+from sagemaker.workflow.pipeline_context import PipelineSession
+
+from ml_pipeline.helpers.pipeline.steps.transform.batch_transform_job import (
+    create_transform_step,
+    create_transformer,
+    get_transform_payload_config
+)
+
+
+def test_get_transform_payload_config_returns_expected_values():
+    payload_config = get_transform_payload_config(
+        avg_record_bytes=10 * 1024,
+        records_per_request=1000,
+        instance_vcpus=16
+    )
+
+    assert payload_config["max_payload"] == 10
+    assert payload_config["max_concurrent_transforms"] == 10
+
+
+def test_get_transform_payload_config_fits_at_least_one_record():
+    payload_config = get_transform_payload_config(avg_record_bytes=200 * 1024 * 1024 // 1000)
+
+    assert payload_config["max_payload"] == 100
+    assert payload_config["max_concurrent_transforms"] is None
+
+    with pytest.raises(ValueError):
+        get_transform_payload_config(avg_record_bytes=101 * 1024 * 1024)
+
+
+def test_create_transformer_returns_expected_objects():
+    transformer = create_transformer(
+        base_job_name="test_job",
+        model_name="model",
+        instance_type="type1",
+        output_path="s3://bucket/output",
+        instance_count=2,
+        max_payload=10,
+        max_concurrent_transforms=4
+    )
+
+    assert transformer.model_name == "model"
+    assert transformer.instance_count == 2
+    assert transformer.strategy == "MultiRecord"
+    assert transformer.assemble_with == "Line"
+    assert transformer.max_payload == 10
+    assert transformer.max_concurrent_transforms == 4
+
+
+def test_create_transform_step_returns_expected_objects():
+    transformer = create_transformer(
+        base_job_name="test_job",
+        model_name="model",
+        instance_type="ml.m5.xlarge",
+        output_path="s3://bucket/output",
+        instance_count=2,
+        max_payload=10,
+        sagemaker_session=PipelineSession(default_bucket="bucket")
+    )
+
+    step = create_transform_step(
+        step_name="transform_test",
+        transformer=transformer,
+        data="s3a://bucket/inference_input",
+        processing_step="processing_test"
+    )
+    transform_input = step.arguments["TransformInput"]
+
+    assert step.depends_on == ["processing_test"]
+    assert step.arguments["ModelName"] == "model"
+    assert step.arguments["MaxPayloadInMB"] == 10
+    assert step.arguments["TransformResources"]["InstanceCount"] == 2
+    assert transform_input["DataSource"]["S3DataSource"]["S3Uri"] == "s3://bucket/inference_input"
+    assert transform_input["ContentType"] == "text/csv"
+    assert transform_input["SplitType"] == "Line"
@@ -15,12 +15,15 @@ Description: SagaMaker Pipeline with PySpark Processor
 
 # import code requirements
 # standard libraries import
-import logging
 import json
+import os
+import sys
 
 # sagemaker model import
 import sagemaker
 from sagemaker.workflow.pipeline import Pipeline
+from sagemaker.workflow.execution_variables import ExecutionVariables
+from sagemaker.workflow.functions import Join
 from sagemaker.workflow.pipeline_experiment_config import PipelineExperimentConfig
 from sagemaker.workflow.steps import CacheConfig
 from sagemaker.processing import ProcessingInput
@@ -31,6 +34,24 @@ from sagemaker.spark.processing import PySparkProcessor
 from helpers.infra.networking.networking import get_network_configuration
 from helpers.infra.tags.tags import get_tags_input
 from helpers.pipeline_utils import get_pipeline_config
+from helpers.pipeline.steps.training.training_job import (
+    create_estimator,
+    create_training_step,
+    get_output_file_count
+)
+from helpers.pipeline.steps.transform.batch_transform_job import (
+    create_transformer,
+    create_transform_step,
+    get_transform_payload_config
+)
+
+# logging helpers shared with the processing job
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "helper"))
+from log_utils import setup_logging
+
+# folder of the processing output with the parquet training data (see process_pyspark.TRAINING_DATA_FOLDER)
+TRAINING_DATA_FOLDER = "train"
+
 
 def create_pipeline(pipeline_params, logger):
     """
@@ -55,9 +76,16 @@ def create_pipeline(pipeline_params, logger):
     # Get Pipeline Configurations
     pipeline_config = get_pipeline_config(pipeline_params)
 
+    # a training step is added when its entry point is configured
+    training_enabled = bool(pipeline_params.get("training_entry_point"))
+    # a batch transform step is added when the model to run inference with is configured
+    transform_enabled = bool(pipeline_params.get("transform_model_name"))
+    publish_output = bool(pipeline_params.get("pyspark_process_publish_output"))
+
     # setting processing cache obj
+    # a cached processing step does not write the run folder of the current execution that training reads from
     logger.info("Setting " + pipeline_params["pyspark_process_name"] + " cache configuration 3 to 30 days")
-    cache_config = CacheConfig(enable_caching=True, expire_after="p30d")
+    cache_config = CacheConfig(enable_caching=not (training_enabled and publish_output), expire_after="p30d")
 
     # Create PySpark Processing Step
     logger.info("Creating " + pipeline_params["pyspark_process_name"] + " processor")
@@ -73,20 +101,62 @@ def create_pipeline(pipeline_params, logger):
         output_kms_key=pipeline_params["pyspark_process_output_kms"],
         network_config=network_config,
         tags=tags_input,
+        # python threads map to their own jvm threads, so per thread scheduler pools work (default from spark 3.2)
+        env={"PYSPARK_PIN_THREAD": "true"},
         sagemaker_session=sagemaker_session
     )
     
+    # processing input arguments. To add new arguments to this list you need to provide two entrances:
+    # 1st is the argument name preceded by "--" and the 2nd is the argument value
+    # setting up processing arguments
+    if pipeline_params.get("pyspark_process_datasets_manifest"):
+        if training_enabled or transform_enabled:
+            # the training and transform steps read the output of the single table mode
+            raise ValueError("pyspark_process_datasets_manifest cannot be used with training_entry_point or "
+                             "transform_model_name")
+        # process all the tables of the manifest in this job instead of the input and output tables
+        processing_arguments = [
+            "--datasets_manifest", pipeline_params["pyspark_process_datasets_manifest"],
+            "--max_parallel_tables", str(pipeline_params.get("pyspark_process_max_parallel_tables", 4))
+        ]
+    else:
+        processing_arguments = [
+            "--input_table", pipeline_params["pyspark_process_data_input"],
+            "--output_table", pipeline_params["pyspark_process_data_output"]
+        ]
+        if pipeline_params.get("pyspark_process_input_manifest"):
+            processing_arguments += ["--input_manifest", pipeline_params["pyspark_process_input_manifest"]]
+            if pipeline_params.get("pyspark_process_input_manifest_max_age"):
+                # inputs without a _SUCCESS marker reuse their manifest until it is older than this
+                processing_arguments += ["--input_manifest_max_age",
+                                         str(pipeline_params["pyspark_process_input_manifest_max_age"])]
+    if pipeline_params.get("pyspark_process_committer"):
+        processing_arguments += ["--committer", pipeline_params["pyspark_process_committer"]]
+    if publish_output:
+        # each execution writes to its own run folder and publishes it once the write succeeds
+        processing_arguments += [
+            "--run_id", ExecutionVariables.PIPELINE_EXECUTION_ID,
+            "--keep_runs", str(pipeline_params.get("pyspark_process_keep_runs", 2))
+        ]
+    if training_enabled:
+        # write a multiple of the training instance count so every instance of a sharded channel gets the same data
+        output_files = get_output_file_count(
+            instance_count=pipeline_params["training_instance_count"],
+            files_per_instance=pipeline_params.get("training_files_per_instance", 1)
+        )
+        processing_arguments += ["--output_files", str(output_files)]
+    if transform_enabled:
+        # one inference input file per transform instance
+        processing_arguments += [
+            "--inference_output", pipeline_params["transform_data_input"],
+            "--inference_files", str(pipeline_params["transform_instance_count"])
+        ]
+
     # setting up arguments
     run_ags = processing_pyspark_processor.run(
         submit_app=pipeline_params["pyspark_process_code"],
-        submit_py_files=[pipeline_params["pyspark_helper_code"]],
-        arguments=[
-        # processing input arguments. To add new arguments to this list you need to provide two entrances:
-        # 1st is the argument name preceded by "--" and the 2nd is the argument value
-        # setting up processing arguments
-            "--input_table", pipeline_params["pyspark_process_data_input"],
-            "--output_table", pipeline_params["pyspark_process_data_output"]
-        ],
+        submit_py_files=pipeline_params["pyspark_helper_code"],
+        arguments=processing_arguments,
         spark_event_logs_s3_uri=pipeline_params["process_spark_ui_log_output"].format(pipeline_params["trial"]),
         inputs = [
             ProcessingInput(
@@ -107,12 +177,80 @@ def create_pipeline(pipeline_params, logger):
         cache_config=cache_config,
     )
 
+    steps = [pyspark_processing_step]
+
+    # Create Training Step
+    if training_enabled:
+        logger.info("Creating " + pipeline_params["training_name"] + " training step")
+        if not pipeline_params.get("training_estimator_type"):
+            # sklearn, the create_estimator default, cannot train on the multiple instances a sharded channel needs
+            raise ValueError("training_estimator_type must be provided when training_entry_point is set. "
+                             "Allowed values: sklearn, mxnet, pytorch, tensorflow or xgboost")
+        estimator = create_estimator(
+            estimator_name=pipeline_params["training_name"],
+            estimator_entry_point=pipeline_params["training_entry_point"],
+            estimator_code_dir=pipeline_params["training_code_dir"],
+            role=pipeline_params["pipeline_role"],
+            instance_type=pipeline_params["training_instance_type"],
+            instance_count=pipeline_params["training_instance_count"],
+            framework_version=pipeline_params["training_framework_version"],
+            tags=tags_input,
+            subnets=pipeline_params["network_subnet_ids"],
+            security_group_ids=pipeline_params["network_security_group_ids"],
+            sagemaker_session=sagemaker_session,
+            estimator_type=pipeline_params["training_estimator_type"]
+        )
+        # the processing job writes the parquet training data, and nothing else, to the train folder of its output
+        # (SageMaker channels need s3:// uris)
+        output_uri = pipeline_params["pyspark_process_data_output"].replace("s3a://", "s3://", 1).rstrip("/")
+        training_data_uri = f"{output_uri}/{TRAINING_DATA_FOLDER}/"
+        if publish_output:
+            # training reads the run folder written by this execution
+            training_data_uri = Join(on="", values=[f"{output_uri}/run_id=", ExecutionVariables.PIPELINE_EXECUTION_ID,
+                                                    f"/{TRAINING_DATA_FOLDER}/"])
+        steps.append(
+            create_training_step(
+                step_name=pipeline_params["training_name"],
+                estimator=estimator,
+                processing_step=pyspark_processing_step,
+                training_data_uri=training_data_uri,
+                input_mode=pipeline_params.get("training_input_mode", "FastFile"),
+                distribution=pipeline_params.get("training_data_distribution", "ShardedByS3Key")
+            )
+        )
+
+    # Create Batch Transform Step
+    if transform_enabled:
+        logger.info("Creating " + pipeline_params["transform_name"] + " transform step")
+        # payload sized from the record size logged by the processing job on a previous run
+        payload_config = get_transform_payload_config(
+            avg_record_bytes=pipeline_params["transform_avg_record_bytes"],
+            instance_vcpus=pipeline_params.get("transform_instance_vcpus")
+        )
+        transformer = create_transformer(
+            base_job_name=pipeline_params["transform_name"],
+            model_name=pipeline_params["transform_model_name"],
+            instance_type=pipeline_params["transform_instance_type"],
+            output_path=pipeline_params["transform_data_output"],
+            instance_count=pipeline_params["transform_instance_count"],
+            max_payload=payload_config["max_payload"],
+            max_concurrent_transforms=payload_config["max_concurrent_transforms"],
+            tags=tags_input,
+            sagemaker_session=sagemaker_session
+        )
+        steps.append(
+            create_transform_step(
+                step_name=pipeline_params["transform_name"],
+                transformer=transformer,
+                data=pipeline_params["transform_data_input"],
+                processing_step=pyspark_processing_step
+            )
+        )
+
     # Create Pipeline
     pipeline = Pipeline(
         name=pipeline_params["pipeline_name"],
-        steps=[
-            pyspark_processing_step
-        ],
+        steps=steps,
         pipeline_experiment_config=PipelineExperimentConfig(
             pipeline_params["pipeline_name"],
             pipeline_config["trial"]
@@ -129,8 +267,7 @@ def create_pipeline(pipeline_params, logger):
 
 def main():
     # set up logging
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
+    logger = setup_logging(__name__, component="pipeline-builder")
     logger.info("Get Pipeline Parameter")
 
     with open("ml_pipeline/params/pipeline_params.json", "r") as f:
@@ -0,0 +1,109 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Shared fixtures for the local spark tests of src
+             The helper modules are shipped to the processing job as flat py files, so the tests import them
+             the same way. Performance budgets fail a test when it takes longer, shuffles more bytes or
+             plans more scans or shuffles than expected
+"""
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(SRC_DIR, "helper"), os.path.join(SRC_DIR, "processing")]
+# python workers import the helpers of functions sent to the executors, like the py files of the job
+os.environ["PYTHONPATH"] = os.pathsep.join(sys.path[:2] + [os.environ.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+
+SAMPLE_DATA_PATH = os.path.join(SRC_DIR, "..", "sample_data", "abalone_data.csv")
+
+
+@pytest.fixture(scope="session")
+def spark():
+    pytest.importorskip("pyspark")
+    from spark_session import get_spark_session, stop_spark_session
+
+    session = get_spark_session(app_name="tests", profile="local", log_level="ERROR")
+    yield session
+    stop_spark_session()
+
+
+def get_physical_plan(df):
+    """
+    Get the physical plan of a dataframe as a string
+    """
+    return df._jdf.queryExecution().executedPlan().toString()
+
+
+def count_plan_nodes(df, node_name):
+    """
+    Count the nodes of a physical plan by name, e.g. FileScan or Exchange (ReusedExchange and
+    BroadcastExchange are not counted as Exchange)
+    """
+    return len(re.findall(rf"(?:^|[\s+:-]){node_name}\s", get_physical_plan(df), flags=re.MULTILINE))
+
+
+def get_shuffle_write_bytes(spark):
+    """
+    Get the shuffle bytes written by all the executors of the session so far
+    """
+    spark_context = spark.sparkContext._jsc.sc()
+    # task metrics are added to the status store by the listener bus asynchronously
+    spark_context.listenerBus().waitUntilEmpty()
+    executors = spark_context.statusStore().executorList(False)
+    return sum(executors.apply(i).totalShuffleWrite() for i in range(executors.size()))
+
+
+@pytest.fixture
+def perf_budget(spark):
+    """
+    Context manager failing the test when the block exceeds its runtime or shuffle bytes budget
+    Usage:
+        with perf_budget(seconds=30, shuffle_bytes=0):
+            ...
+    """
+    @contextmanager
+    def budget(seconds, shuffle_bytes=None):
+        shuffle_bytes_before = get_shuffle_write_bytes(spark)
+        start = time.time()
+        yield
+        runtime = time.time() - start
+        assert runtime <= seconds, f"runtime budget exceeded: {runtime:.1f}s > {seconds}s"
+        if shuffle_bytes is not None:
+            shuffled = get_shuffle_write_bytes(spark) - shuffle_bytes_before
+            assert shuffled <= shuffle_bytes, f"shuffle budget exceeded: {shuffled} bytes > {shuffle_bytes} bytes"
+
+    return budget
+
+
+@pytest.fixture
+def plan_node_count():
+    """
+    Function counting the nodes of the physical plan of a dataframe by name. See count_plan_nodes
+    """
+    return count_plan_nodes
+
+
+@pytest.fixture
+def caller_session(spark, monkeypatch):
+    """
+    The test session as if the caller had built it without get_spark_session, with its own settings
+    """
+    import spark_session
+
+    monkeypatch.setattr(spark_session, "_spark_session", None)
+    spark.conf.set("spark.sql.shuffle.partitions", "7")
+    yield spark
+    spark.conf.set("spark.sql.shuffle.partitions", "4")
@@ -13,10 +13,17 @@
 Description: Example of data utils file for pyspark processor
              This file presents code examples for:
               * read parquet data from s3
-              * set logs to be displayed with the start of the job execution
+              * sample a deterministic subset of input files for dry runs
+              * read an explicit list of input files (e.g. from an input manifest)
+              * write data to a run scoped folder, publish it atomically and remove old runs
+              * write evenly sized batch transform input files
+              * deduplicate and upsert data into a partitioned output
 """
 # standard libraries import
 import logging
+import math
+import re
+import zlib
 from pathlib import Path
 
 # aws libraries
@@ -24,33 +31,120 @@ import boto3
 
 # pyspark libraries import
 from pyspark.sql.functions import input_file_name
+from pyspark.sql.window import Window
 import pyspark.sql.functions as f
 
-class Unbuffered(object):
+from spark_session import get_spark_session
+
+def _get_hadoop_path(spark, path):
+    """
+    Get the Hadoop FileSystem and Path objects for a path using the spark session configuration
+    Args:
+        spark (SparkSession): PySpark session
+        path (str): path (s3 or local) to resolve
+    Returns:
+        (org.apache.hadoop.fs.FileSystem): file system handling the path
+        (org.apache.hadoop.fs.Path): hadoop path object
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    return hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()), hadoop_path
+
+
+def list_data_files(spark, path):
     """
-    Class to print logs in real time during job execution
+    List the data files under a path recursively, skipping hidden and metadata files (e.g. _SUCCESS)
+    Args:
+        spark (SparkSession): PySpark session. If None, the shared session from get_spark_session is used
+        path (str): path where the data is located. Can be a folder or a single file
+    Returns:
+        (list[tuple]): list of (file path, size in bytes) sorted by file path
     """
-    def __init__(self, stream):
-        self.stream = stream
+    spark = spark or get_spark_session()
+    fs, hadoop_path = _get_hadoop_path(spark, path)
+    files = []
+    iterator = fs.listFiles(hadoop_path, True)
+    while iterator.hasNext():
+        status = iterator.next()
+        if status.getPath().getName().startswith(("_", ".")):
+            continue
+        files.append((status.getPath().toString(), status.getLen()))
+    return sorted(files)
 
-    def write(self, data):
-        self.stream.write(data)
-        self.stream.flush()
 
-    def writelines(self, data):
-        self.stream.writelines(data)
-        self.stream.flush()
+def sample_input_files(files, sample_fraction=None, sample_files=None):
+    """
+    Select a deterministic subset of input files. Files are ranked by a stable hash of their path, so the same
+    input always yields the same sample and the sample is spread across partitions instead of taking the first ones
+    Args:
+        files (list[tuple]): list of (file path, size in bytes) as returned by list_data_files
+        sample_fraction (float): fraction of the files to select. Must be in the interval (0, 1]
+        sample_files (int): number of files to select
+    Returns:
+        (list[tuple]): selected (file path, size in bytes) sorted by file path
+    """
+    if (sample_fraction is None) == (sample_files is None):
+        raise ValueError("Exactly one of sample_fraction or sample_files must be provided")
 
-    def __getattr__(self, attr):
-        return getattr(self.stream, attr)
+    if sample_fraction is not None and not 0 < sample_fraction <= 1:
+        raise ValueError(f"sample_fraction must be in the interval (0, 1]. Found {sample_fraction}")
+
+    if sample_files is not None and sample_files < 1:
+        raise ValueError(f"sample_files must be a positive integer. Found {sample_files}")
+
+    if not files:
+        raise ValueError("No input files found to sample from")
+
+    if sample_files is None:
+        sample_files = max(1, math.ceil(len(files) * sample_fraction))
+    ranked = sorted(files, key=lambda file: (zlib.crc32(file[0].encode("utf-8")), file[0]))
+    return sorted(ranked[:sample_files])
+
+
+def project_full_run(total_input_bytes, sample_input_bytes, sample_runtime_seconds, sample_output_bytes,
+                     fixed_runtime_seconds=0.0):
+    """
+    Extrapolate the runtime and output size of a full run from a sampled run, assuming both scale linearly
+    with the input size. The fixed cost of a run (job setup, listing, commit) is paid once and is not scaled
+    Args:
+        total_input_bytes (int): size of the full input
+        sample_input_bytes (int): size of the sampled input
+        sample_runtime_seconds (float): runtime of the sampled run
+        sample_output_bytes (int): size of the output written by the sampled run
+        fixed_runtime_seconds (float): part of the sampled runtime that does not depend on the input size,
+                                       e.g. the runtime of the same job over no rows
+    Returns:
+        (dict): scale factor, fixed runtime in seconds, projected runtime in seconds and projected output size in bytes
+    """
+    if sample_input_bytes <= 0:
+        raise ValueError("sample_input_bytes must be greater than 0 to project a full run")
+
+    scale_factor = total_input_bytes / sample_input_bytes
+    fixed_runtime_seconds = min(fixed_runtime_seconds, sample_runtime_seconds)
+    variable_runtime_seconds = sample_runtime_seconds - fixed_runtime_seconds
+    return {
+        "scale_factor": scale_factor,
+        "fixed_runtime_seconds": fixed_runtime_seconds,
+        "projected_runtime_seconds": fixed_runtime_seconds + variable_runtime_seconds * scale_factor,
+        "projected_output_bytes": int(sample_output_bytes * scale_factor)
+    }
+
+
+def _get_file_name_col(spark):
+    # the hidden _metadata column of file sources (spark 3.3+) is deterministic, unlike input_file_name, so
+    # filters on the dataframe are still pushed down to the file scan and prune its partitions
+    if tuple(int(part) for part in spark.version.split(".")[:2]) >= (3, 3):
+        return f.col("_metadata.file_path")
+    return input_file_name()
 
 
 def spark_read_parquet(spark, path, logger, merge_schema="true", header="true", add_partition_to_cols=False,
-                       partition_col=None, schema=None, date_partition=False, date_format=None):
+                       partition_col=None, schema=None, date_partition=False, date_format=None,
+                       sample_fraction=None, sample_files=None, input_files=None, resolve_published=False,
+                       add_file_name_col=False):
     """
     Read data from s3 into a pyspark dataframe with relevant logging
     Args:
-        spark (SparkSession): PySpark session
+        spark (SparkSession): PySpark session. If None, the shared session from get_spark_session is used
         path (str): path where the data is located in s3
         logger (logging): logging obj
         merge_schema (str): string with boolean value to merge multiple parquet
@@ -61,6 +155,16 @@ def spark_read_parquet(spark, path, logger, merge_schema="true", header="true",
                              It supplies null values to any columns missing from the parquet partitions
         date_partition (bool): boolean to indicate if partition column is a date
         date_format (str): date format in case partition column is a date
+        sample_fraction (float): if provided, read only this fraction of the files under path (see sample_input_files)
+        sample_files (int): if provided, read only this number of files under path (see sample_input_files)
+        input_files (list[tuple]): explicit list of (file path, size in bytes) under path to read instead of listing
+                                   path, e.g. from s3_manifest.get_manifest_files. Partitions are still discovered
+                                   relative to path
+        resolve_published (bool): boolean to indicate if path was written with a run_id (see spark_save_data)
+                                  and the current published run should be read
+        add_file_name_col (bool): boolean to indicate if the path of the file of every row should be added to data
+                                  as a filename col. Before spark 3.3 the col is computed with input_file_name, which
+                                  is not deterministic and stops later filters from being pushed down to the file scan
     Returns:
         (pyspark.DataFrame): spark df with data
     """
@@ -74,34 +178,174 @@ def spark_read_parquet(spark, path, logger, merge_schema="true", header="true",
     if date_partition and (date_format is None):
         raise ValueError("date_format cannot be None if date_partition = True")
 
+    spark = spark or get_spark_session()
+    if resolve_published:
+        path = resolve_output_path(spark, path)
+
     fn_col = "filename"
-    if schema:
-        df = spark.read \
+    reader = spark.read \
                   .option("mergeSchema", merge_schema) \
-                  .option("header", header) \
-                  .schema(schema) \
-                  .parquet(path) \
-                  .withColumn(fn_col, input_file_name())
+                  .option("header", header)
+    if schema:
+        reader = reader.schema(schema)
     else:
-        df = spark.read \
-                  .option("mergeSchema", merge_schema) \
-                  .option("header", header) \
-                  .option("inferSchema", "true") \
-                  .parquet(path)\
-                  .withColumn(fn_col, input_file_name())
+        reader = reader.option("inferSchema", "true")
+
+    paths = [path]
+    files = input_files
+    if (sample_fraction is not None) or (sample_files is not None):
+        files = files if files is not None else list_data_files(spark, path)
+        sampled_files = sample_input_files(files, sample_fraction=sample_fraction, sample_files=sample_files)
+        logger.info(f"Sampled {len(sampled_files)} of {len(files)} files from {path}")
+        files = sampled_files
+
+    if files is not None:
+        paths = [file_path for file_path, _ in files]
+        fs, hadoop_path = _get_hadoop_path(spark, path)
+        if fs.getFileStatus(hadoop_path).isDirectory():
+            # keep partition discovery relative to the original path when reading individual files
+            reader = reader.option("basePath", path)
+
+    df = reader.parquet(*paths)
+    if add_file_name_col:
+        df = df.withColumn(fn_col, _get_file_name_col(spark))
     if add_partition_to_cols:
-        # creating the column partition from path partition
-        df = df.withColumn(partition_col, f.split(f.col(fn_col), "=").getItem(1)) \
-               .drop(fn_col)
+        if partition_col in df.columns:
+            # the column discovered from the partition folders keeps filters on it pushed down to the file scan
+            df = df.withColumn(partition_col, f.col(partition_col).cast("string"))
+        else:
+            # partitions are not discovered when reading single files without a base path:
+            # create the column from the path, matching the partition folder by name to skip other col=value folders
+            partition_pattern = rf"{re.escape(partition_col)}=([^/]+)"
+            df = df.withColumn(partition_col, f.regexp_extract(_get_file_name_col(spark), partition_pattern, 1))
         if date_partition:
-            df = df.withColumn(partition_col, f.to_timestamp(f.split(f.col(partition_col), "/").getItem(0), date_format))
+            df = df.withColumn(partition_col, f.to_timestamp(f.col(partition_col), date_format))
 
     logger.info(f"Read data from {path} with schema as: {str(df.columns)}")
     return df
 
 
+CURRENT_MARKER = "_CURRENT"
+RUNS_HISTORY = "_RUNS"
+
+
+def get_run_output_path(output_path, run_id):
+    """
+    Get the run scoped folder where a run writes its output before publishing it
+    Args:
+        output_path (str): output path readers use
+        run_id (str): unique id of the run, e.g. the pipeline execution id
+    Returns:
+        (str): path of the run folder, as output_path/run_id=<run_id>
+    """
+    return f"{output_path.rstrip('/')}/run_id={run_id}"
+
+
+def _read_text(spark, path):
+    fs, hadoop_path = _get_hadoop_path(spark, path)
+    if not fs.exists(hadoop_path):
+        return None
+    stream = fs.open(hadoop_path)
+    try:
+        return spark._jvm.org.apache.commons.io.IOUtils.toString(stream, "UTF-8")
+    finally:
+        stream.close()
+
+
+def _write_text(spark, path, text):
+    fs, hadoop_path = _get_hadoop_path(spark, path)
+    stream = fs.create(hadoop_path, True)
+    try:
+        stream.write(bytearray(text.encode("utf-8")))
+    finally:
+        stream.close()
+
+
+def publish_output(spark, output_path, run_id, logger=None):
+    """
+    Publish the output of a run by pointing the _CURRENT marker of output_path to the run folder.
+    The marker is a single small object, so on s3 readers switch from the previous run to the new one
+    atomically and never see a partially written output. The run is also added to the _RUNS history
+    used by remove_old_runs
+    Args:
+        spark (SparkSession): PySpark session. If None, the shared session from get_spark_session is used
+        output_path (str): output path readers use
+        run_id (str): unique id of the run whose output is published
+        logger (logging): logging obj
+    Returns:
+        (str): path of the published run folder
+    """
+    spark = spark or get_spark_session()
+    run_path = get_run_output_path(output_path, run_id)
+    history = get_published_runs(spark, output_path)
+    history = [path for path in history if path != run_path] + [run_path]
+    _write_text(spark, f"{output_path.rstrip('/')}/{RUNS_HISTORY}", "\n".join(history))
+    _write_text(spark, f"{output_path.rstrip('/')}/{CURRENT_MARKER}", run_path)
+    if logger:
+        logger.info(f"Published {run_path} as current output of {output_path}")
+    return run_path
+
+
+def get_published_runs(spark, output_path):
+    """
+    Get the run folders published on output_path, oldest first. See publish_output
+    Args:
+        spark (SparkSession): PySpark session. If None, the shared session from get_spark_session is used
+        output_path (str): output path readers use
+    Returns:
+        (list[str]): paths of the published run folders
+    """
+    spark = spark or get_spark_session()
+    history = _read_text(spark, f"{output_path.rstrip('/')}/{RUNS_HISTORY}")
+    return [line.strip() for line in (history or "").splitlines() if line.strip()]
+
+
+def remove_old_runs(spark, output_path, keep_runs=2, logger=None):
+    """
+    Delete the folders of the published runs of output_path except the keep_runs most recent ones.
+    Keeping the previous run (keep_runs >= 2) lets readers that resolved it before the last publish finish.
+    Folders of runs that were never published (e.g. failed or still running) are not deleted
+    Args:
+        spark (SparkSession): PySpark session. If None, the shared session from get_spark_session is used
+        output_path (str): output path readers use
+        keep_runs (int): number of most recent published runs to keep, including the current one
+        logger (logging): logging obj
+    Returns:
+        (list[str]): paths of the deleted run folders
+    """
+    if keep_runs < 1:
+        raise ValueError(f"keep_runs must be at least 1. Found {keep_runs}")
+
+    spark = spark or get_spark_session()
+    history = get_published_runs(spark, output_path)
+    removed, kept = history[:-keep_runs], history[-keep_runs:]
+    for run_path in removed:
+        fs, hadoop_path = _get_hadoop_path(spark, run_path)
+        fs.delete(hadoop_path, True)
+    if removed:
+        _write_text(spark, f"{output_path.rstrip('/')}/{RUNS_HISTORY}", "\n".join(kept))
+        if logger:
+            logger.info(f"Removed {len(removed)} old runs of {output_path}: {removed}")
+    return removed
+
+
+def resolve_output_path(spark, output_path):
+    """
+    Resolve the path of the published output of output_path. See publish_output
+    Args:
+        spark (SparkSession): PySpark session. If None, the shared session from get_spark_session is used
+        output_path (str): output path readers use
+    Returns:
+        (str): path of the current run folder or output_path itself if no run was published
+    """
+    spark = spark or get_spark_session()
+    current = _read_text(spark, f"{output_path.rstrip('/')}/{CURRENT_MARKER}")
+    return current.strip() if current is not None else output_path
+
+
 def spark_save_data(df, output_path, output_content_type="text/csv", mode="overwrite", header="true",
-                    partition_data=False, partition_col=None):
+                    partition_data=False, partition_col=None, run_id=None, publish=True, keep_runs=2,
+                    success_marker=True, logger=None):
     """
     Save data using pyspark. This function can save data to s3 and locally using csv or parquet data formats
     Args:
@@ -113,21 +357,150 @@ def spark_save_data(df, output_path, output_content_type="text/csv", mode="overw
                       Allowed values: true or false
         partition_data (bool): boolean to indicate if data should be partitioned
         partition_col (str): column to partition data on. Must be provided if partition_date = True
+        run_id (str): if provided, data is written to a run scoped folder under output_path and published once the
+                      write succeeds (see publish_output). Readers must resolve output_path with resolve_output_path.
+                      Only allowed with mode overwrite
+        publish (bool): boolean to indicate if the run should be published after the write. Pass False to add
+                        more files to the run folder before calling publish_output. Only used with run_id
+        keep_runs (int): number of most recent published runs kept after publishing (see remove_old_runs).
+                         None keeps every run. Only used with run_id
+        success_marker (bool): boolean to indicate if a _SUCCESS file is written next to the data. Pass False when
+                               every object under the path must be a data file, e.g. for a training channel
+                               sharded by s3 key
+        logger (logging): logging obj
+    Returns:
+        (str): path where the data was written
     """
     if output_content_type not in ["text/csv", "application/x-parquet"]:
         raise TypeError(f"Invalid output_content_type value. Found {output_content_type}. "
                         f"Allowed values: text/csv or application/x-parquet")
+
+    if run_id is not None and mode != "overwrite":
+        raise ValueError("run_id can only be provided with mode = overwrite")
+
+    published_path = output_path
+    if run_id is not None:
+        output_path = get_run_output_path(published_path, run_id)
+
+    # write options are added to the job configuration the output committer reads
+    writer = df.write.mode(mode) \
+               .option("mapreduce.fileoutputcommitter.marksuccessfuljobs", str(success_marker).lower())
     if partition_data:
         if output_content_type == "text/csv":
-            df.write.mode(mode).partitionBy(partition_col).format("com.databricks.spark.csv")\
+            writer.partitionBy(partition_col).format("com.databricks.spark.csv")\
               .option("header", header).save(output_path)
 
         else:
-            df.write.mode(mode).partitionBy(partition_col)\
+            writer.partitionBy(partition_col)\
               .option("header", header).save(output_path)
     else:
         if output_content_type == "text/csv":
-            df.write.mode(mode).format("com.databricks.spark.csv").option("header", header).save(output_path)
+            writer.format("com.databricks.spark.csv").option("header", header).save(output_path)
 
         else:
-            df.write.mode(mode).option("header", header).save(output_path)
+            writer.option("header", header).save(output_path)
+
+    if run_id is not None and publish:
+        spark = df.sql_ctx.sparkSession
+        publish_output(spark, published_path, run_id, logger=logger)
+        if keep_runs is not None:
+            remove_old_runs(spark, published_path, keep_runs=keep_runs, logger=logger)
+    return output_path
+
+
+def spark_save_inference_input(df, output_path, instance_count, files_per_instance=1, logger=None):
+    """
+    Save batch transform input as headerless csv (one record per line) split into evenly sized files, so that
+    every transform instance receives the same amount of data. The average record size is measured on the
+    written files to size the transform payload (see batch_transform_job.get_transform_payload_config)
+    Args:
+        df (pyspark.sql.DataFrame): PySpark DataFrame with the inference records
+        output_path (str): path to save data to. Usually an s3 path
+        instance_count (int): number of transform instances
+        files_per_instance (int): number of files per transform instance. Default 1
+        logger (logging): logging obj
+    Returns:
+        (dict): number of files, number of records and average record size in bytes
+    """
+    spark = df.sql_ctx.sparkSession
+    file_count = instance_count * files_per_instance
+    df.repartition(file_count).write.mode("overwrite").option("header", "false").csv(output_path)
+
+    total_bytes = sum(size for _, size in list_data_files(spark, output_path))
+    record_count = spark.read.text(output_path).count()
+    stats = {
+        "files": file_count,
+        "records": record_count,
+        "avg_record_bytes": total_bytes / record_count if record_count else 0
+    }
+    if logger:
+        logger.info(f"Wrote inference input to {output_path}: {stats}")
+    return stats
+
+
+def deduplicate(df, key_cols, order_col):
+    """
+    Keep one row per key: the one with the highest value of order_col
+    Args:
+        df (pyspark.sql.DataFrame): PySpark DataFrame with data to deduplicate
+        key_cols (list[str]): columns identifying a record
+        order_col (str): column ordering the versions of a record, e.g. an update timestamp
+    Returns:
+        (pyspark.sql.DataFrame): spark df with a single row per key
+    """
+    window = Window.partitionBy(*key_cols).orderBy(f.col(order_col).desc())
+    return df.withColumn("_row_number", f.row_number().over(window)) \
+             .filter(f.col("_row_number") == 1) \
+             .drop("_row_number")
+
+
+def spark_upsert_data(df, output_path, key_cols, order_col, partition_col, logger=None):
+    """
+    Deduplicate incoming data and upsert it into a parquet output partitioned by partition_col.
+    Only the partitions present in the incoming data are read and rewritten; the other partitions are not touched.
+    A record is expected to stay in the same partition across versions (e.g. partitioned by event date).
+    Dynamic partition overwrite is not supported by the s3a committers, so use the default committer and do not
+    combine it with run_id publishing (see spark_save_data)
+    Args:
+        df (pyspark.sql.DataFrame): PySpark DataFrame with incoming data. Must contain key_cols, order_col and
+                                    partition_col
+        output_path (str): path of the partitioned parquet output. Usually an s3 path
+        key_cols (list[str]): columns identifying a record
+        order_col (str): column ordering the versions of a record. On ties, the incoming row wins
+        partition_col (str): column the output is partitioned on
+        logger (logging): logging obj
+    Returns:
+        (list): partition values rewritten
+    """
+    spark = df.sql_ctx.sparkSession
+    incoming_col = "_is_incoming"
+    incoming = deduplicate(df, key_cols, order_col)
+    partition_values = [row[0] for row in incoming.select(partition_col).distinct().collect()]
+
+    fs, hadoop_path = _get_hadoop_path(spark, output_path)
+    merged = incoming
+    if fs.exists(hadoop_path):
+        partition_filter = f.col(partition_col).isin([v for v in partition_values if v is not None])
+        if None in partition_values:
+            partition_filter = partition_filter | f.col(partition_col).isNull()
+        existing = spark.read.parquet(output_path).where(partition_filter)
+        # partition values are read back from folder names, so align their type with the incoming data
+        existing = existing.withColumn(partition_col,
+                                       f.col(partition_col).cast(incoming.schema[partition_col].dataType))
+        merged = existing.withColumn(incoming_col, f.lit(0)) \
+                         .unionByName(incoming.withColumn(incoming_col, f.lit(1)), allowMissingColumns=True)
+        window = Window.partitionBy(*key_cols).orderBy(f.col(order_col).desc(), f.col(incoming_col).desc())
+        merged = merged.withColumn("_row_number", f.row_number().over(window)) \
+                       .filter(f.col("_row_number") == 1) \
+                       .drop("_row_number", incoming_col)
+        # materialize the merge before overwriting the partitions it reads from
+        merged = merged.localCheckpoint(eager=True)
+
+    merged.write.mode("overwrite") \
+          .option("partitionOverwriteMode", "dynamic") \
+          .partitionBy(partition_col) \
+          .parquet(output_path)
+
+    if logger:
+        logger.info(f"Upserted {len(partition_values)} partitions of {output_path}: {partition_values}")
+    return partition_values
@@ -0,0 +1,152 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Structured logging shared by the processing job and the pipeline builder
+             This file presents code examples for:
+              * format logs as json records with job and stage context
+              * buffer logs and flush them from a background thread instead of on every line
+              * flush errors immediately so they show in CloudWatch in real time
+"""
+# standard libraries import
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROCESSING_JOB_CONFIG_PATH = "/opt/ml/config/processingjobconfig.json"
+
+_stage = contextvars.ContextVar("stage", default=None)
+
+
+def get_job_context(job_config_path=PROCESSING_JOB_CONFIG_PATH):
+    """
+    Get the context of the SageMaker processing job the code runs in
+    Args:
+        job_config_path (str): path to the SageMaker processing job configuration file
+    Returns:
+        (dict): processing job name or an empty dict when not running on SageMaker
+    """
+    if not os.path.exists(job_config_path):
+        return {}
+    with open(job_config_path, "r") as f:
+        return {"job_name": json.load(f).get("ProcessingJobName")}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as single line json with the job context and the current stage
+    """
+    def __init__(self, context=None):
+        super().__init__()
+        self.context = context or {}
+
+    def format(self, record):
+        payload = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **self.context
+        }
+        if _stage.get() is not None:
+            payload["stage"] = _stage.get()
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class BufferedHandler(logging.Handler):
+    """
+    Handler that buffers formatted records and writes them in batches: every flush_interval seconds from a
+    background thread, when the buffer reaches capacity, or immediately for records at or above flush_level
+    """
+    def __init__(self, stream=None, flush_interval=5.0, flush_level=logging.ERROR, capacity=1000):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.capacity = capacity
+        self.buffer = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_periodically, name="log-flush", daemon=True)
+        self._thread.start()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record))
+            if record.levelno >= self.flush_level or len(self.buffer) >= self.capacity:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                self.stream.write("\n".join(self.buffer) + "\n")
+                self.buffer = []
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+        super().close()
+
+
+def setup_logging(name, level=logging.INFO, stream=None, flush_interval=5.0, flush_level=logging.ERROR, **context):
+    """
+    Get a logger emitting buffered json records. Calling it again for the same name returns the same logger
+    Args:
+        name (str): logger name
+        level (int): logging level
+        stream (io.TextIOBase): stream to write to. Default sys.stdout
+        flush_interval (float): maximum number of seconds a record stays in the buffer
+        flush_level (int): records at or above this level are written immediately
+        context: extra fields added to every record, e.g. component="pipeline-builder"
+    Returns:
+        (logging.Logger): logger
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if not any(isinstance(handler, BufferedHandler) for handler in logger.handlers):
+        handler = BufferedHandler(stream=stream, flush_interval=flush_interval, flush_level=flush_level)
+        handler.setFormatter(JsonFormatter({**get_job_context(), **context}))
+        logger.addHandler(handler)
+    return logger
+
+
+@contextmanager
+def log_stage(logger, stage):
+    """
+    Add the stage to the records logged inside the block and log its duration
+    Args:
+        logger (logging.Logger): logger
+        stage (str): stage name
+    """
+    token = _stage.set(stage)
+    start = time.time()
+    logger.info(f"Starting {stage}")
+    try:
+        yield
+    finally:
+        logger.info(f"Finished {stage} in {time.time() - start:.1f}s")
+        _stage.reset(token)
@@ -0,0 +1,263 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Lint the physical plan of the processing job before running it on a cluster
+             This file presents code examples for:
+              * walk the physical plan of a dataframe through its query execution
+              * detect cartesian joins, row at a time python udfs, repeated scans and oversized broadcasts
+              * detect filters that are applied after the file scan instead of being pushed down to it
+              * detect collect and toPandas calls in the processing code
+              * run the checks against the processing entry point in local mode
+"""
+# standard libraries import
+import argparse
+import ast
+import importlib.util
+import logging
+import os
+import re
+import sys
+
+from log_utils import setup_logging
+
+SEVERITIES = ["warning", "error"]
+
+# rule name: (severity, description)
+RULES = {
+    "cartesian_product": ("error", "join without equality keys compares every pair of rows"),
+    "python_udf": ("error", "row at a time python udf sends every row to a python worker"),
+    "pandas_udf": ("warning", "vectorized python udf moves the data between the jvm and python"),
+    "missing_pushed_filters": ("warning", "filter applied after the file scan instead of pushed down to it"),
+    "repeated_scan": ("warning", "the same files are scanned more than once"),
+    "oversized_broadcast": ("error", "broadcast relation larger than the broadcast threshold"),
+    "driver_collect": ("warning", "collect or toPandas brings the whole dataframe to the driver"),
+}
+
+# physical plan node class: rule
+NODE_RULES = {
+    "CartesianProductExec": "cartesian_product",
+    "BroadcastNestedLoopJoinExec": "cartesian_product",
+    "BatchEvalPythonExec": "python_udf",
+    "ArrowEvalPythonExec": "pandas_udf",
+    "FlatMapGroupsInPandasExec": "pandas_udf",
+    "MapInPandasExec": "pandas_udf",
+}
+
+# nodes between a filter and its file scan that do not prevent the filter from being pushed down
+PASS_THROUGH_NODES = {"ProjectExec", "ColumnarToRowExec", "InputAdapter", "WholeStageCodegenExec"}
+
+DRIVER_COLLECT_METHODS = {"collect", "toPandas"}
+
+DEFAULT_BROADCAST_THRESHOLD = 10 * 1024 * 1024
+
+logger = setup_logging(__name__, component="plan-lint")
+
+
+def _finding(rule, message):
+    severity, description = RULES[rule]
+    return {"rule": rule, "severity": severity, "message": f"{description}: {message}"}
+
+
+def _strip_expression_ids(text):
+    # expression ids (id#12L) differ between two reads of the same files
+    return re.sub(r"#\d+L?", "", text)
+
+
+def _get_children(node):
+    children = node.children()
+    return [children.apply(i) for i in range(children.size())]
+
+
+def _get_plan_nodes(node):
+    """
+    Get the nodes of a physical plan in depth first order. Adaptive plans and query stages are unwrapped,
+    reused exchanges are returned without their children so that reused work is not reported twice
+    """
+    name = node.getClass().getSimpleName()
+    if name == "AdaptiveSparkPlanExec":
+        return _get_plan_nodes(node.executedPlan())
+    if name.endswith("QueryStageExec"):
+        return _get_plan_nodes(node.plan())
+
+    nodes = [node]
+    if name != "ReusedExchangeExec":
+        for child in _get_children(node):
+            nodes.extend(_get_plan_nodes(child))
+    return nodes
+
+
+def _get_scan_path(scan):
+    return scan.relation().location().rootPaths().mkString(",")
+
+
+def _get_size_in_bytes(node):
+    """
+    Get the estimated size of the output of a physical plan node from the statistics of its logical plan
+    Returns:
+        (int): size in bytes or None when no node of the subtree is linked to a logical plan
+    """
+    while node is not None:
+        logical_plan = node.logicalLink()
+        if logical_plan.isDefined():
+            return int(logical_plan.get().stats().sizeInBytes())
+        children = _get_children(node)
+        node = children[0] if children else None
+    return None
+
+
+def get_broadcast_threshold(spark):
+    """
+    Get the broadcast threshold of the session
+    Args:
+        spark (SparkSession): spark session
+    Returns:
+        (int): spark.sql.autoBroadcastJoinThreshold in bytes or the spark default when broadcasts are disabled
+    """
+    threshold = spark.conf.get("spark.sql.autoBroadcastJoinThreshold", str(DEFAULT_BROADCAST_THRESHOLD))
+    threshold = spark._jvm.org.apache.spark.network.util.JavaUtils.byteStringAsBytes(threshold)
+    return threshold if threshold > 0 else DEFAULT_BROADCAST_THRESHOLD
+
+
+def lint_plan(df, max_broadcast_bytes=None):
+    """
+    Inspect the physical plan of a dataframe for expensive patterns. The plan is not executed
+    Args:
+        df (DataFrame): dataframe to inspect
+        max_broadcast_bytes (int): largest estimated size allowed for a broadcast relation.
+                                   Defaults to the broadcast threshold of the session of the dataframe
+    Returns:
+        (list[dict]): findings as {rule, severity, message}
+    """
+    if max_broadcast_bytes is None:
+        max_broadcast_bytes = get_broadcast_threshold(df.sql_ctx.sparkSession)
+
+    findings = []
+    scans = {}
+    for node in _get_plan_nodes(df._jdf.queryExecution().executedPlan()):
+        name = node.getClass().getSimpleName()
+
+        if name in NODE_RULES:
+            findings.append(_finding(NODE_RULES[name], _strip_expression_ids(node.simpleString(10))))
+
+        elif name == "FileSourceScanExec":
+            key = (_get_scan_path(node), node.requiredSchema().simpleString(),
+                   _strip_expression_ids(node.dataFilters().toString()),
+                   _strip_expression_ids(node.partitionFilters().toString()))
+            scans[key] = scans.get(key, 0) + 1
+
+        elif name == "FilterExec":
+            child = _get_children(node)[0]
+            while child.getClass().getSimpleName() in PASS_THROUGH_NODES:
+                child = _get_children(child)[0]
+            if child.getClass().getSimpleName() == "FileSourceScanExec" \
+                    and child.dataFilters().size() == 0 and child.partitionFilters().size() == 0:
+                findings.append(_finding("missing_pushed_filters",
+                                         f"{_strip_expression_ids(node.condition().sql())} "
+                                         f"on {_get_scan_path(child)}"))
+
+        elif name == "BroadcastExchangeExec":
+            size_in_bytes = _get_size_in_bytes(_get_children(node)[0])
+            if size_in_bytes is not None and size_in_bytes > max_broadcast_bytes:
+                findings.append(_finding("oversized_broadcast",
+                                         f"estimated {size_in_bytes} bytes > {max_broadcast_bytes} bytes"))
+
+    for (path, schema, _, _), count in scans.items():
+        if count > 1:
+            findings.append(_finding("repeated_scan", f"{path} {schema} scanned {count} times"))
+    return findings
+
+
+def lint_source(path):
+    """
+    Find the collect and toPandas calls of a python file. Calls on a limit(n) dataframe are allowed
+    Args:
+        path (str): path to the python file
+    Returns:
+        (list[dict]): findings as {rule, severity, message}
+    """
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    findings = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in DRIVER_COLLECT_METHODS):
+            continue
+        receiver = node.func.value
+        limited = False
+        while isinstance(receiver, ast.Call) and isinstance(receiver.func, ast.Attribute):
+            limited = limited or receiver.func.attr == "limit"
+            receiver = receiver.func.value
+        if not limited:
+            findings.append(_finding("driver_collect", f"{node.func.attr}() at {path}:{node.lineno}"))
+    return findings
+
+
+def has_failures(findings, fail_on="error"):
+    """
+    Check if any finding is at or above a severity
+    Args:
+        findings (list[dict]): findings as returned by lint_plan or lint_source
+        fail_on (str): lowest severity that fails. Allowed values: warning or error
+    Returns:
+        (bool): True if a finding is at or above fail_on
+    """
+    if fail_on not in SEVERITIES:
+        raise ValueError(f"Invalid severity. Found {fail_on}. Allowed values: {SEVERITIES}")
+    return any(SEVERITIES.index(finding["severity"]) >= SEVERITIES.index(fail_on) for finding in findings)
+
+
+def load_entry_point(path):
+    """
+    Import a processing script as a module without running its __main__ block
+    Args:
+        path (str): path to the processing script
+    Returns:
+        (module): imported module
+    """
+    # the processing scripts import the helpers and their neighbours as flat modules
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+if __name__ == "__main__":
+    from spark_session import get_spark_session
+
+    parser = argparse.ArgumentParser(description="lint the physical plan of a processing entry point")
+    parser.add_argument("--entry_point", type=str, default="src/processing/process_pyspark.py",
+                        help="path to the processing script")
+    parser.add_argument("--function", type=str, default="main",
+                        help="function of the processing script returning the dataframe to lint")
+    parser.add_argument("--input_table", type=str, default="sample_data/abalone_data.csv",
+                        help="path to local input data passed to the function")
+    parser.add_argument("--max_broadcast_bytes", type=int, default=None,
+                        help="largest estimated size allowed for a broadcast relation")
+    parser.add_argument("--fail_on", type=str, default="error",
+                        help="lowest severity that fails the lint. Allowed values: warning or error")
+    args = parser.parse_args()
+
+    # the entry point gets this local session when it calls get_spark_session
+    get_spark_session(app_name="PlanLint", profile="local")
+
+    df = getattr(load_entry_point(args.entry_point), args.function)(args.input_table)
+    findings = lint_plan(df, max_broadcast_bytes=args.max_broadcast_bytes) + lint_source(args.entry_point)
+
+    for finding in findings:
+        logger.log(logging.ERROR if finding["severity"] == "error" else logging.WARNING,
+                   f"{finding['rule']}: {finding['message']}")
+    logger.info(f"Found {len(findings)} plan lint issues in {args.entry_point}")
+
+    if has_failures(findings, fail_on=args.fail_on):
+        sys.exit(1)
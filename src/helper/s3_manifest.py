@@ -0,0 +1,301 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Input manifest for large s3 prefixes
+             This file presents code examples for:
+              * list an s3 prefix in parallel (one paginated listing per sub-prefix)
+              * save the listing (path, size, ETag and partition values) into a compact manifest file
+              * reuse the manifest across steps and runs while the prefix is unchanged
+"""
+# standard libraries import
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# aws libraries
+import boto3
+from botocore.exceptions import ClientError
+
+# version 2 identifies the marker by ETag, last modified time and version id instead of its ETag only
+MANIFEST_VERSION = 2
+S3_SCHEMES = ("s3", "s3a", "s3n")
+
+
+def split_s3_uri(uri):
+    """
+    Split an s3 uri into its scheme, bucket and key
+    Args:
+        uri (str): s3 uri. Allowed schemes: s3, s3a or s3n
+    Returns:
+        (str): uri scheme
+        (str): bucket name
+        (str): object key or prefix
+    """
+    scheme, sep, rest = uri.partition("://")
+    if not sep or scheme not in S3_SCHEMES:
+        raise ValueError(f"Invalid s3 uri. Found {uri}. Allowed schemes: {S3_SCHEMES}")
+    bucket, _, key = rest.partition("/")
+    return scheme, bucket, key
+
+
+def is_s3_uri(uri):
+    """
+    Check if a path is an s3 uri
+    Args:
+        uri (str): path
+    Returns:
+        (bool): True if the path has an s3, s3a or s3n scheme
+    """
+    return uri.partition("://")[0] in S3_SCHEMES
+
+
+def read_bytes(uri, s3_client=None):
+    """
+    Read the content of a file from s3 or the local file system
+    Args:
+        uri (str): s3 uri or local path of the file
+        s3_client (botocore.client.S3): s3 client. If not provided, a default client is created
+    Returns:
+        (bytes): file content or None if the file does not exist
+    """
+    if not is_s3_uri(uri):
+        if not os.path.exists(uri):
+            return None
+        with open(uri, "rb") as f:
+            return f.read()
+
+    s3_client = s3_client or boto3.client("s3")
+    _, bucket, key = split_s3_uri(uri)
+    try:
+        return s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+
+
+def write_bytes(uri, data, s3_client=None):
+    """
+    Write content to a file in s3 or in the local file system
+    Args:
+        uri (str): s3 uri or local path of the file
+        data (bytes): content to write
+        s3_client (botocore.client.S3): s3 client. If not provided, a default client is created
+    """
+    if not is_s3_uri(uri):
+        os.makedirs(os.path.dirname(os.path.abspath(uri)), exist_ok=True)
+        with open(uri, "wb") as f:
+            f.write(data)
+        return
+
+    s3_client = s3_client or boto3.client("s3")
+    _, bucket, key = split_s3_uri(uri)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=data)
+
+
+def _get_marker_version(s3_client, bucket, key):
+    """
+    Identify the current version of a marker object. The ETag alone is not enough: a zero byte _SUCCESS
+    always has the ETag of empty content, so a rewritten marker is only detected by its last modified
+    time (or its version id on versioned buckets)
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket, Key=key)
+        return "|".join([response["ETag"], response["LastModified"].isoformat(), response.get("VersionId") or ""])
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+
+
+def _list_level(s3_client, bucket, prefix):
+    """
+    List the objects directly under a prefix and its sub-prefixes (one level, using "/" as delimiter)
+    """
+    objects, sub_prefixes = [], []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        objects.extend(page.get("Contents", []))
+        sub_prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+    return objects, sub_prefixes
+
+
+def _list_all(s3_client, bucket, prefix):
+    """
+    List all objects under a prefix recursively
+    """
+    objects = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get("Contents", []))
+    return objects
+
+
+def _get_partition_values(relative_key):
+    """
+    Get the hive style partition values (col=value) from the folders of an object key
+    """
+    folders = relative_key.split("/")[:-1]
+    return dict(folder.split("=", 1) for folder in folders if "=" in folder)
+
+
+def build_manifest(uri, s3_client=None, max_workers=16, fanout_depth=1, marker_name="_SUCCESS"):
+    """
+    List all data files under an s3 prefix in parallel and build a manifest with them.
+    The prefix is expanded fanout_depth levels deep (e.g. one level per partition column) and each
+    sub-prefix found is listed in its own paginated listing on a thread pool.
+    Hidden and metadata files (starting with "_" or ".") are not included in the manifest
+    Args:
+        uri (str): s3 uri of the data prefix (or of a single file)
+        s3_client (botocore.client.S3): s3 client. Pass a client with a custom endpoint_url to use a local s3
+                                        stand-in. If not provided, a default client is created
+        max_workers (int): number of threads listing sub-prefixes
+        fanout_depth (int): number of folder levels to expand before listing each sub-prefix recursively
+        marker_name (str): name of the marker object used to detect changes on the prefix. See load_or_build_manifest
+    Returns:
+        (dict): manifest with the uri, creation time, marker version and a list of files as
+                [key relative to the prefix, size in bytes, ETag, partition values]
+    """
+    s3_client = s3_client or boto3.client("s3")
+    _, bucket, key = split_s3_uri(uri)
+    prefix = key if (not key or key.endswith("/")) else key + "/"
+
+    objects = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        prefixes = [prefix]
+        for _ in range(fanout_depth):
+            next_prefixes = []
+            for level_objects, sub_prefixes in pool.map(lambda p: _list_level(s3_client, bucket, p), prefixes):
+                objects.extend(level_objects)
+                next_prefixes.extend(sub_prefixes)
+            prefixes = next_prefixes
+        for prefix_objects in pool.map(lambda p: _list_all(s3_client, bucket, p), prefixes):
+            objects.extend(prefix_objects)
+
+    if not objects and key and not key.endswith("/"):
+        # the uri points to a single object instead of a folder
+        response = s3_client.head_object(Bucket=bucket, Key=key)
+        objects = [{"Key": key, "Size": response["ContentLength"], "ETag": response["ETag"]}]
+        prefix = key.rsplit("/", 1)[0] + "/" if "/" in key else ""
+
+    marker_version = _get_marker_version(s3_client, bucket, prefix + marker_name)
+
+    files = []
+    for obj in objects:
+        relative_key = obj["Key"][len(prefix):]
+        if not relative_key or relative_key.rsplit("/", 1)[-1].startswith(("_", ".")):
+            continue
+        files.append([relative_key, obj["Size"], obj["ETag"].strip('"'), _get_partition_values(relative_key)])
+
+    return {
+        "version": MANIFEST_VERSION,
+        "uri": uri,
+        "prefix": prefix,
+        "created_at": time.time(),
+        "marker_version": marker_version,
+        "files": sorted(files)
+    }
+
+
+def save_manifest(manifest, manifest_uri, s3_client=None):
+    """
+    Save a manifest as gzip compressed json to s3 or to the local file system
+    Args:
+        manifest (dict): manifest as returned by build_manifest
+        manifest_uri (str): s3 uri or local path of the manifest file
+        s3_client (botocore.client.S3): s3 client. If not provided, a default client is created
+    """
+    data = gzip.compress(json.dumps(manifest, separators=(",", ":")).encode("utf-8"))
+    write_bytes(manifest_uri, data, s3_client=s3_client)
+
+
+def load_manifest(manifest_uri, s3_client=None):
+    """
+    Load a manifest saved with save_manifest
+    Args:
+        manifest_uri (str): s3 uri or local path of the manifest file
+        s3_client (botocore.client.S3): s3 client. If not provided, a default client is created
+    Returns:
+        (dict): manifest or None if the manifest file does not exist
+    """
+    data = read_bytes(manifest_uri, s3_client=s3_client)
+    if data is None:
+        return None
+    return json.loads(gzip.decompress(data).decode("utf-8"))
+
+
+def load_or_build_manifest(uri, manifest_uri, logger=None, s3_client=None, max_age_seconds=None,
+                           marker_name="_SUCCESS", **build_kwargs):
+    """
+    Load the manifest of a prefix if it is still valid, otherwise build it and save it.
+    An existing manifest is reused when:
+        * the prefix has a marker object (e.g. _SUCCESS) that was not rewritten since the manifest was built
+          (same ETag, last modified time and version id), or
+        * the manifest is younger than max_age_seconds
+    Checking the marker costs a single HEAD request instead of listing the whole prefix again
+    Args:
+        uri (str): s3 uri of the data prefix
+        manifest_uri (str): s3 uri or local path of the manifest file
+        logger (logging): logging obj
+        s3_client (botocore.client.S3): s3 client. If not provided, a default client is created
+        max_age_seconds (int): maximum age of a manifest to be reused when the prefix has no marker
+        marker_name (str): name of the marker object rewritten by the producer of the prefix on every write
+        build_kwargs: extra arguments for build_manifest
+    Returns:
+        (dict): manifest as returned by build_manifest
+    """
+    s3_client = s3_client or boto3.client("s3")
+    manifest = load_manifest(manifest_uri, s3_client=s3_client)
+
+    if manifest is not None and manifest["version"] == MANIFEST_VERSION and manifest["uri"] == uri:
+        _, bucket, _ = split_s3_uri(uri)
+        marker_version = _get_marker_version(s3_client, bucket, manifest["prefix"] + marker_name)
+        if marker_version is not None and marker_version == manifest["marker_version"]:
+            reuse_reason = f"{marker_name} is unchanged"
+        elif max_age_seconds is not None and time.time() - manifest["created_at"] <= max_age_seconds:
+            reuse_reason = f"manifest is younger than {max_age_seconds}s"
+        else:
+            reuse_reason = None
+        if reuse_reason:
+            if logger:
+                logger.info(f"Reusing manifest {manifest_uri} for {uri}: {reuse_reason}")
+            return manifest
+
+    if logger:
+        logger.info(f"Building manifest {manifest_uri} for {uri}")
+    manifest = build_manifest(uri, s3_client=s3_client, marker_name=marker_name, **build_kwargs)
+    save_manifest(manifest, manifest_uri, s3_client=s3_client)
+    if logger:
+        logger.info(f"Manifest for {uri} has {len(manifest['files'])} files")
+    return manifest
+
+
+def get_manifest_files(manifest, partition_values=None):
+    """
+    Get the full path of the files of a manifest, using the same scheme as the manifest uri (e.g. s3a)
+    Args:
+        manifest (dict): manifest as returned by build_manifest
+        partition_values (dict): optional filter as {partition col: list of values} to keep only matching files
+    Returns:
+        (list[tuple]): list of (file path, size in bytes) sorted by file path
+    """
+    scheme, bucket, _ = split_s3_uri(manifest["uri"])
+    base = f"{scheme}://{bucket}/{manifest['prefix']}"
+    files = []
+    for relative_key, size, _, partitions in manifest["files"]:
+        if partition_values and any(partitions.get(col) not in [str(v) for v in values]
+                                    for col, values in partition_values.items()):
+            continue
+        files.append((base + relative_key, size))
+    return files
@@ -0,0 +1,454 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Mergeable sketches for approximate statistics on feature pipelines
+             This file presents code examples for:
+              * approximate distinct counts (HyperLogLog)
+              * approximate quantiles (KLL)
+              * approximate heavy hitters (count-min sketch)
+              * compute sketches per partition on vectorized pandas batches and combine them without a shuffle
+              * persist sketches and merge daily increments into running totals
+"""
+# standard libraries import
+import base64
+import gzip
+import json
+import math
+import random
+from array import array
+
+import numpy as np
+import pandas as pd
+
+# pyspark libraries import
+import pyspark.sql.functions as f
+
+from s3_manifest import read_bytes, write_bytes
+
+
+def _to_strings(values):
+    return np.asarray(pd.Series(values, dtype=object).astype(str), dtype=object)
+
+
+def _hash_values(values):
+    """
+    Stable 64 bit hashes of the string representation of values. Python hash() is randomized per process,
+    so it cannot be used for sketches built on different executors
+    """
+    return pd.util.hash_array(_to_strings(values))
+
+
+def _bit_length(values):
+    # frexp is exact on the 32 bit halves, a float conversion of the 64 bit values is not
+    high, low = (values >> np.uint64(32)).astype(np.float64), (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog sketch for approximate distinct counts. Relative error is about 1.04 / sqrt(2 ** precision)
+    (0.8% with the default precision of 14) using 2 ** precision bytes
+    """
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"precision must be between 4 and 18. Found {precision}")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        self.add_values([value])
+
+    def add_values(self, values):
+        """
+        Add a batch of values
+        Args:
+            values (list|pandas.Series): values without nulls
+        """
+        hashes = _hash_values(values)
+        remaining_bits = 64 - self.precision
+        indexes = (hashes >> np.uint64(remaining_bits)).astype(np.intp)
+        ranks = remaining_bits - _bit_length(hashes & np.uint64((1 << remaining_bits) - 1)) + 1
+        np.maximum.at(np.frombuffer(self.registers, dtype=np.uint8), indexes, ranks.astype(np.uint8))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        self.registers = bytearray(np.maximum(np.frombuffer(self.registers, dtype=np.uint8),
+                                              np.frombuffer(other.registers, dtype=np.uint8)).tobytes())
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        registers = np.frombuffer(self.registers, dtype=np.uint8).astype(np.float64)
+        estimate = alpha * m * m / float(np.exp2(-registers).sum())
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(precision=data["precision"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+
+class KllSketch(object):
+    """
+    KLL sketch for approximate quantiles of numeric values. Rank error is about 1.7 / k
+    (under 1% with the default k of 200) using O(k) memory
+    """
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(int(math.ceil(self.k * (2.0 / 3.0) ** depth)), 2)
+
+    def _size(self):
+        return sum(len(compactor) for compactor in self.compactors)
+
+    def _max_size(self):
+        return sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _compress(self):
+        for level in range(len(self.compactors)):
+            if len(self.compactors[level]) >= self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+                items = sorted(self.compactors[level])
+                # an odd item out stays in the level
+                leftover = [items.pop()] if len(items) % 2 else []
+                self.compactors[level + 1].extend(items[self._random.randint(0, 1)::2])
+                self.compactors[level] = leftover
+                if self._size() < self._max_size():
+                    break
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.n += 1
+        if self._size() >= self._max_size():
+            self._compress()
+
+    def add_values(self, values):
+        """
+        Add a batch of values. The batch is compacted at once, which is as accurate as adding the values one by one
+        Args:
+            values (list|pandas.Series): numeric values without nulls
+        """
+        # a sorted batch keeps the sort of the compactions cheap
+        self.compactors[0].extend(np.sort(np.asarray(values)).tolist())
+        self.n += len(values)
+        while self._size() >= self._max_size():
+            self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        while self._size() >= self._max_size():
+            self._compress()
+        return self
+
+    def quantiles(self, probabilities):
+        """
+        Get approximate quantiles
+        Args:
+            probabilities (list[float]): probabilities in the interval [0, 1]
+        Returns:
+            (list): approximate quantile of each probability. None values if the sketch is empty
+        """
+        weighted = sorted((item, 2 ** level) for level, items in enumerate(self.compactors) for item in items)
+        if not weighted:
+            return [None for _ in probabilities]
+        total_weight = sum(weight for _, weight in weighted)
+        results = []
+        for probability in probabilities:
+            target, cumulative = probability * total_weight, 0
+            for item, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+            results.append(item)
+        return results
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(k=data["k"])
+        sketch.n = data["n"]
+        sketch.compactors = [list(items) for items in data["compactors"]]
+        return sketch
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch with a list of candidate heavy hitters. Counts are over-estimated by at most
+    e / width * total count with probability 1 - exp(-depth). Values are tracked as strings
+    """
+    def __init__(self, width=2048, depth=5, top_k=20):
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.total = 0
+        self.table = array("q", [0]) * (width * depth)
+        self.candidates = {}
+
+    def _indexes(self, values):
+        """
+        Get the table index of values in every row, as an array of shape (depth, number of values). The rows use
+        the double hashing h1 + row * h2 of the two 32 bit halves of the hash
+        """
+        hashes = _hash_values(values)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        columns = ((hashes & np.uint64(0xFFFFFFFF)) + rows * (hashes >> np.uint64(32))) % np.uint64(self.width)
+        return (rows * np.uint64(self.width) + columns).astype(np.intp)
+
+    def _estimates(self, values):
+        return np.frombuffer(self.table, dtype=np.int64)[self._indexes(values)].min(axis=0)
+
+    def estimate(self, value):
+        return int(self._estimates([value])[0])
+
+    def _prune_candidates(self):
+        if len(self.candidates) > 2 * self.top_k:
+            values = list(self.candidates)
+            estimates = self._estimates(values).tolist()
+            self.candidates = dict(sorted(zip(values, estimates), key=lambda item: -item[1])[:self.top_k])
+
+    def _add_counts(self, values, counts):
+        indexes = self._indexes(values)
+        np.add.at(np.frombuffer(self.table, dtype=np.int64), indexes.ravel(), np.tile(counts, self.depth))
+        self.total += int(counts.sum())
+        # only the most frequent values of the batch can become heavy hitters
+        estimates = np.frombuffer(self.table, dtype=np.int64)[indexes].min(axis=0)
+        for i in np.argsort(-estimates, kind="stable")[:self.top_k]:
+            self.candidates[values[i]] = int(estimates[i])
+        self._prune_candidates()
+
+    def add(self, value, count=1):
+        self._add_counts(_to_strings([value]), np.asarray([count], dtype=np.int64))
+
+    def add_values(self, values):
+        """
+        Add a batch of values
+        Args:
+            values (list|pandas.Series): values without nulls
+        """
+        value_counts = pd.Series(_to_strings(values), dtype=object).value_counts()
+        self._add_counts(value_counts.index.to_numpy(dtype=object), value_counts.to_numpy(dtype=np.int64))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge count-min sketches with different width or depth")
+        np.frombuffer(self.table, dtype=np.int64)[:] += np.frombuffer(other.table, dtype=np.int64)
+        self.total += other.total
+        values = sorted(set(self.candidates) | set(other.candidates))
+        self.candidates = dict(zip(values, self._estimates(values).tolist())) if values else {}
+        self._prune_candidates()
+        return self
+
+    def heavy_hitters(self, n=None):
+        """
+        Get the most frequent values
+        Args:
+            n (int): number of values to return. Defaults to top_k
+        Returns:
+            (list[tuple]): list of (value, estimated count) sorted by estimated count
+        """
+        return sorted(self.candidates.items(), key=lambda item: (-item[1], item[0]))[:n or self.top_k]
+
+    def to_dict(self):
+        return {
+            "width": self.width,
+            "depth": self.depth,
+            "top_k": self.top_k,
+            "total": self.total,
+            "table": base64.b64encode(self.table.tobytes()).decode("ascii"),
+            "candidates": self.candidates
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(width=data["width"], depth=data["depth"], top_k=data["top_k"])
+        sketch.total = data["total"]
+        sketch.table = array("q")
+        sketch.table.frombytes(base64.b64decode(data["table"]))
+        sketch.candidates = dict(data["candidates"])
+        return sketch
+
+
+SKETCH_TYPES = {
+    "distinct": HyperLogLog,
+    "quantiles": KllSketch,
+    "heavy_hitters": CountMinSketch
+}
+
+
+class SketchSet(object):
+    """
+    Sketches of several columns of a dataset, as {sketch type: {column: sketch}}
+    """
+    def __init__(self, distinct_cols=(), quantile_cols=(), heavy_hitter_cols=()):
+        self.sketches = {
+            "distinct": {col: HyperLogLog() for col in distinct_cols},
+            "quantiles": {col: KllSketch() for col in quantile_cols},
+            "heavy_hitters": {col: CountMinSketch() for col in heavy_hitter_cols}
+        }
+
+    def columns(self):
+        return sorted({col for sketches in self.sketches.values() for col in sketches})
+
+    def add_row(self, row):
+        for sketches in self.sketches.values():
+            for col, sketch in sketches.items():
+                if row[col] is not None:
+                    sketch.add(row[col])
+
+    def add_batch(self, batch):
+        """
+        Add a batch of rows. Null values are skipped
+        Args:
+            batch (pandas.DataFrame): rows with a "<sketch type>:<column>" column per sketch
+        """
+        for sketch_type, sketches in self.sketches.items():
+            for col, sketch in sketches.items():
+                values = batch[f"{sketch_type}:{col}"].dropna()
+                if len(values):
+                    sketch.add_values(values)
+
+    def merge(self, other):
+        for sketch_type, sketches in other.sketches.items():
+            if set(sketches) != set(self.sketches[sketch_type]):
+                raise ValueError(f"Cannot merge sketch sets with different {sketch_type} columns")
+            for col, sketch in sketches.items():
+                self.sketches[sketch_type][col].merge(sketch)
+        return self
+
+    def summary(self, probabilities=(0.01, 0.25, 0.5, 0.75, 0.99)):
+        """
+        Get the statistics of every sketched column
+        Args:
+            probabilities (list[float]): probabilities of the quantiles to report
+        Returns:
+            (dict): distinct counts, quantiles and heavy hitters per column
+        """
+        return {
+            "distinct": {col: sketch.count() for col, sketch in self.sketches["distinct"].items()},
+            "quantiles": {col: dict(zip(probabilities, sketch.quantiles(probabilities)))
+                          for col, sketch in self.sketches["quantiles"].items()},
+            "heavy_hitters": {col: sketch.heavy_hitters() for col, sketch in self.sketches["heavy_hitters"].items()}
+        }
+
+    def to_dict(self):
+        return {sketch_type: {col: sketch.to_dict() for col, sketch in sketches.items()}
+                for sketch_type, sketches in self.sketches.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch_set = cls()
+        sketch_set.sketches = {sketch_type: {col: SKETCH_TYPES[sketch_type].from_dict(sketch)
+                                             for col, sketch in data.get(sketch_type, {}).items()}
+                               for sketch_type in SKETCH_TYPES}
+        return sketch_set
+
+
+def compute_sketches(df, distinct_cols=(), quantile_cols=(), heavy_hitter_cols=()):
+    """
+    Compute the sketches of a dataframe. Every partition builds its own sketches from arrow batches with
+    mapInPandas, which are then combined with a tree aggregate, so no shuffle of the data is needed
+    Args:
+        df (pyspark.sql.DataFrame): PySpark DataFrame with the data to sketch
+        distinct_cols (list[str]): columns to estimate the distinct count of
+        quantile_cols (list[str]): numeric columns to estimate quantiles of
+        heavy_hitter_cols (list[str]): columns to estimate the most frequent values of
+    Returns:
+        (SketchSet): sketches of the dataframe
+    """
+    def build_partition_sketches(batches):
+        sketch_set, empty = SketchSet(distinct_cols, quantile_cols, heavy_hitter_cols), True
+        for batch in batches:
+            sketch_set.add_batch(batch)
+            empty = empty and batch.empty
+        if not empty:
+            yield pd.DataFrame({"sketches": [json.dumps(sketch_set.to_dict())]})
+
+    # hashed values are sketched as strings, so an integer column with nulls is not hashed as pandas floats
+    sketch_cols = [f.col(col).cast("double" if sketch_type == "quantiles" else "string").alias(f"{sketch_type}:{col}")
+                   for sketch_type, cols in [("distinct", distinct_cols), ("quantiles", quantile_cols),
+                                             ("heavy_hitters", heavy_hitter_cols)]
+                   for col in cols]
+    return df.select(*sketch_cols) \
+        .mapInPandas(build_partition_sketches, schema="sketches string").rdd \
+        .map(lambda row: SketchSet.from_dict(json.loads(row.sketches))) \
+        .treeAggregate(SketchSet(distinct_cols, quantile_cols, heavy_hitter_cols),
+                       lambda a, b: a.merge(b), lambda a, b: a.merge(b))
+
+
+def save_sketches(sketch_set, uri):
+    """
+    Save sketches as gzip compressed json
+    Args:
+        sketch_set (SketchSet): sketches to save
+        uri (str): s3 uri or local path of the sketches file
+    """
+    write_bytes(uri, gzip.compress(json.dumps(sketch_set.to_dict()).encode("utf-8")))
+
+
+def load_sketches(uri):
+    """
+    Load sketches saved with save_sketches
+    Args:
+        uri (str): s3 uri or local path of the sketches file
+    Returns:
+        (SketchSet): sketches or None if the file does not exist
+    """
+    data = read_bytes(uri)
+    if data is None:
+        return None
+    return SketchSet.from_dict(json.loads(gzip.decompress(data).decode("utf-8")))
+
+
+def update_sketches(df, uri, distinct_cols=(), quantile_cols=(), heavy_hitter_cols=(), logger=None):
+    """
+    Sketch new data and merge it into the running totals saved in uri, so statistics over all the data
+    only need a pass over the new data
+    Args:
+        df (pyspark.sql.DataFrame): PySpark DataFrame with the new data (e.g. a daily increment)
+        uri (str): s3 uri or local path of the running totals
+        distinct_cols (list[str]): columns to estimate the distinct count of
+        quantile_cols (list[str]): numeric columns to estimate quantiles of
+        heavy_hitter_cols (list[str]): columns to estimate the most frequent values of
+        logger (logging): logging obj
+    Returns:
+        (SketchSet): running totals including the new data
+    """
+    sketch_set = compute_sketches(df, distinct_cols, quantile_cols, heavy_hitter_cols)
+    running_totals = load_sketches(uri)
+    if running_totals is not None:
+        sketch_set = running_totals.merge(sketch_set)
+    save_sketches(sketch_set, uri)
+    if logger:
+        logger.info(f"Updated sketches {uri}: {sketch_set.summary()}")
+    return sketch_set
@@ -0,0 +1,182 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Spark session factory for pyspark processor
+             This file presents code examples for:
+              * create a single spark session shared by the processing script and the helper functions
+              * tune the session with profile based settings (AQE, Arrow, Kryo, s3a)
+              * set the number of shuffle partitions from the cluster size
+              * write to s3 with the s3a magic, partitioned or directory committers
+"""
+# standard libraries import
+import json
+import os
+
+# pyspark libraries import
+from pyspark.sql import SparkSession
+
+# settings shared by every profile
+BASE_SETTINGS = {
+    # adaptive query execution: coalesce small shuffle partitions and split skewed join partitions
+    "spark.sql.adaptive.enabled": "true",
+    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+    "spark.sql.adaptive.skewJoin.enabled": "true",
+    # arrow for pandas conversions and pandas udfs
+    "spark.sql.execution.arrow.pyspark.enabled": "true",
+    "spark.sql.execution.arrow.pyspark.fallback.enabled": "true",
+}
+
+SPARK_PROFILES = {
+    "default": {
+        **BASE_SETTINGS,
+        "spark.serializer": "org.apache.spark.serializer.KryoSerializer",
+        "spark.kryoserializer.buffer.max": "512m",
+        # s3a connection pool and upload tuning
+        "spark.hadoop.fs.s3a.connection.maximum": "200",
+        "spark.hadoop.fs.s3a.threads.max": "64",
+        "spark.hadoop.fs.s3a.fast.upload": "true",
+        "spark.hadoop.fs.s3a.fast.upload.buffer": "bytebuffer",
+        "spark.hadoop.fs.s3a.multipart.size": "128M",
+        # the file output committer keeps its default algorithm: version 2 commits task output straight into
+        # the destination, so failed or retried tasks leave partial output visible. Use an s3a committer
+        # (see S3A_COMMITTERS) to avoid the copy based renames on s3 instead
+    },
+    "local": {
+        **BASE_SETTINGS,
+        "spark.master": "local[2]",
+        "spark.sql.shuffle.partitions": "4",
+        "spark.ui.enabled": "false",
+        "spark.driver.bindAddress": "127.0.0.1",
+    },
+}
+
+# s3a committers write task output straight to s3 as pending multipart uploads, so a job commit is
+# one PUT per file instead of a copy per file. They need the spark-hadoop-cloud module on the classpath
+S3A_COMMITTER_SETTINGS = {
+    "spark.sql.sources.commitProtocolClass": "org.apache.spark.internal.io.cloud.PathOutputCommitProtocol",
+    "spark.sql.parquet.output.committer.class":
+        "org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter",
+    "spark.hadoop.mapreduce.outputcommitter.factory.scheme.s3a":
+        "org.apache.hadoop.fs.s3a.commit.S3ACommitterFactory",
+}
+
+S3A_COMMITTERS = {
+    "magic": {
+        "spark.hadoop.fs.s3a.committer.name": "magic",
+        "spark.hadoop.fs.s3a.committer.magic.enabled": "true",
+    },
+    "partitioned": {
+        "spark.hadoop.fs.s3a.committer.name": "partitioned",
+        # only replace the partitions present in the written data
+        "spark.hadoop.fs.s3a.committer.staging.conflict-mode": "replace",
+    },
+    "directory": {
+        "spark.hadoop.fs.s3a.committer.name": "directory",
+    },
+}
+
+RESOURCE_CONFIG_PATH = "/opt/ml/config/resourceconfig.json"
+
+_spark_session = None
+
+
+def get_cluster_size(resource_config_path=RESOURCE_CONFIG_PATH):
+    """
+    Get the number of instances of the processing job from the SageMaker resource configuration
+    Args:
+        resource_config_path (str): path to the SageMaker resource configuration file
+    Returns:
+        (int): number of instances in the cluster. 1 when not running on SageMaker
+    """
+    if not os.path.exists(resource_config_path):
+        return 1
+    with open(resource_config_path, "r") as f:
+        return len(json.load(f).get("hosts", [])) or 1
+
+
+def get_shuffle_partitions(instance_count, cores_per_instance=None, partitions_per_core=3):
+    """
+    Get the number of shuffle partitions for the cluster. AQE coalesces them at runtime,
+    so this is an upper bound that keeps every core busy on the largest shuffles
+    Args:
+        instance_count (int): number of instances in the cluster
+        cores_per_instance (int): number of cores per instance. Defaults to the cores of the current instance
+        partitions_per_core (int): number of shuffle partitions per core
+    Returns:
+        (int): number of shuffle partitions
+    """
+    cores_per_instance = cores_per_instance or os.cpu_count() or 1
+    return instance_count * cores_per_instance * partitions_per_core
+
+
+def get_spark_settings(profile="default", conf=None, committer=None):
+    """
+    Get the spark settings of a profile
+    Args:
+        profile (str): settings profile. Allowed values: default or local
+        conf (dict): extra spark settings, overriding the profile settings
+        committer (str): s3a committer used to write data to s3a paths. Allowed values: magic, partitioned,
+                         directory or None to keep the file output committer
+    Returns:
+        (dict): spark settings
+    """
+    if profile not in SPARK_PROFILES:
+        raise ValueError(f"Invalid spark profile. Found {profile}. Allowed values: {list(SPARK_PROFILES)}")
+
+    if committer is not None and committer not in S3A_COMMITTERS:
+        raise ValueError(f"Invalid s3a committer. Found {committer}. Allowed values: {list(S3A_COMMITTERS)}")
+
+    settings = dict(SPARK_PROFILES[profile])
+    if profile != "local":
+        settings["spark.sql.shuffle.partitions"] = str(get_shuffle_partitions(get_cluster_size()))
+    if committer is not None:
+        settings.update(S3A_COMMITTER_SETTINGS)
+        settings.update(S3A_COMMITTERS[committer])
+    settings.update(conf or {})
+    return settings
+
+
+def get_spark_session(app_name="PySparkJob", profile="default", conf=None, log_level="ERROR", committer=None):
+    """
+    Get the spark session shared by the job. The session is created on the first call with the settings
+    of the profile; later calls return the same session and ignore the arguments
+    Args:
+        app_name (str): spark application name
+        profile (str): settings profile. Allowed values: default or local
+        conf (dict): extra spark settings, overriding the profile settings
+        log_level (str): spark log level
+        committer (str): s3a committer used to write data to s3a paths. Allowed values: magic, partitioned,
+                         directory or None to keep the file output committer
+    Returns:
+        (SparkSession): PySpark session
+    """
+    global _spark_session
+    settings = get_spark_settings(profile=profile, conf=conf, committer=committer)
+    if _spark_session is not None:
+        return _spark_session
+
+    builder = SparkSession.builder.appName(app_name)
+    for key, value in settings.items():
+        builder = builder.config(key, value)
+    _spark_session = builder.getOrCreate()
+    _spark_session.sparkContext.setLogLevel(log_level)
+    return _spark_session
+
+
+def stop_spark_session():
+    """
+    Stop the shared spark session, so the next get_spark_session call creates a new one
+    """
+    global _spark_session
+    if _spark_session is not None:
+        _spark_session.stop()
+        _spark_session = None
@@ -0,0 +1,369 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for src.helper.data_utils.py
+"""
+import logging
+import os
+import re
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from pyspark.sql import functions as f
+from pyspark.sql.types import StructType, StructField, StringType, LongType, DoubleType
+
+import spark_session
+from conftest import get_physical_plan
+from data_utils import (
+    deduplicate,
+    get_published_runs,
+    list_data_files,
+    project_full_run,
+    remove_old_runs,
+    resolve_output_path,
+    sample_input_files,
+    spark_read_parquet,
+    spark_save_data,
+    spark_save_inference_input,
+    spark_upsert_data
+)
+
+logger = logging.getLogger(__name__)
+
+GOLDEN_ROWS = [
+    (1, "a", 1.0),
+    (2, "a", 2.0),
+    (3, "b", 3.0),
+    (4, "b", 4.0),
+    (5, "c", 5.0),
+    (6, "c", 6.0),
+]
+GOLDEN_SCHEMA = StructType(
+    [
+        StructField("id", LongType(), True),
+        StructField("part", StringType(), True),
+        StructField("value", DoubleType(), True),
+    ]
+)
+
+
+@pytest.fixture(scope="module")
+def golden_data(spark, tmp_path_factory):
+    """
+    Small golden datasets: partitioned, date partitioned and schema drifted parquet, csv with and without header
+    """
+    root = tmp_path_factory.mktemp("golden")
+    df = spark.createDataFrame(GOLDEN_ROWS, GOLDEN_SCHEMA)
+    paths = {name: str(root / name) for name in ["partitioned", "dated", "drifted", "csv_header", "csv_no_header"]}
+
+    df.repartition(1, "part").write.partitionBy("part").parquet(paths["partitioned"])
+
+    dated = spark.createDataFrame([(1, 1.0, "2022-01-01"), (2, 2.0, "2022-01-02")], "id long, value double, dt string")
+    dated.write.partitionBy("dt").parquet(paths["dated"])
+
+    spark.createDataFrame([(1, 1.0)], "id long, value double").write.parquet(paths["drifted"] + "/version=1")
+    spark.createDataFrame([(2, 2.0, "new")], "id long, value double, extra string") \
+         .write.parquet(paths["drifted"] + "/version=2")
+
+    df.coalesce(1).write.option("header", "true").csv(paths["csv_header"])
+    df.coalesce(1).write.option("header", "false").csv(paths["csv_no_header"])
+    return paths
+
+
+def _rows(df, *cols):
+    return sorted(tuple(row) for row in df.select(*cols).collect())
+
+
+def test_sample_input_files_is_deterministic():
+    files = [(f"s3://bucket/data/file_{i}.parquet", 10) for i in range(100)]
+
+    sampled = sample_input_files(files, sample_fraction=0.1)
+
+    assert len(sampled) == 10
+    assert sampled == sample_input_files(list(reversed(files)), sample_fraction=0.1)
+    assert sampled == sorted(sampled)
+    assert len(sample_input_files(files, sample_files=3)) == 3
+
+
+def test_sample_input_files_invalid_arguments_raise():
+    files = [("s3://bucket/data/file.parquet", 10)]
+
+    with pytest.raises(ValueError):
+        sample_input_files(files)
+    with pytest.raises(ValueError):
+        sample_input_files(files, sample_fraction=0.5, sample_files=1)
+    with pytest.raises(ValueError):
+        sample_input_files(files, sample_fraction=1.5)
+    with pytest.raises(ValueError):
+        sample_input_files([], sample_files=1)
+
+
+def test_project_full_run_scales_linearly():
+    projection = project_full_run(total_input_bytes=1000, sample_input_bytes=100, sample_runtime_seconds=6,
+                                  sample_output_bytes=50)
+
+    assert projection == {"scale_factor": 10, "fixed_runtime_seconds": 0, "projected_runtime_seconds": 60,
+                          "projected_output_bytes": 500}
+
+
+def test_project_full_run_does_not_scale_the_fixed_runtime():
+    projection = project_full_run(total_input_bytes=1000, sample_input_bytes=100, sample_runtime_seconds=6,
+                                  sample_output_bytes=50, fixed_runtime_seconds=4)
+
+    assert projection["projected_runtime_seconds"] == 4 + 2 * 10
+    # a fixed runtime measured above the sampled runtime is capped to it
+    assert project_full_run(1000, 100, 6, 50, fixed_runtime_seconds=8)["projected_runtime_seconds"] == 6
+
+
+def test_spark_read_parquet_invalid_arguments_raise(spark):
+    with pytest.raises(ValueError):
+        spark_read_parquet(spark, "path", logger, add_partition_to_cols=True)
+    with pytest.raises(ValueError):
+        spark_read_parquet(spark, "path", logger, date_partition=True)
+    with pytest.raises(ValueError):
+        spark_read_parquet(spark, "path", logger, add_partition_to_cols=True, partition_col="dt",
+                           date_partition=True)
+
+
+def test_spark_read_parquet_partitioned(spark, golden_data, perf_budget, plan_node_count):
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        df = spark_read_parquet(spark, golden_data["partitioned"], logger, add_partition_to_cols=True,
+                                partition_col="part")
+
+        assert _rows(df, "id", "part", "value") == sorted(GOLDEN_ROWS)
+        assert "filename" not in df.columns
+        assert plan_node_count(df, "FileScan") == 1
+        assert plan_node_count(df, "Exchange") == 0
+
+
+def test_spark_read_parquet_partition_of_single_file(spark, golden_data):
+    file_path = [path for path, _ in list_data_files(spark, golden_data["partitioned"]) if "part=b" in path][0]
+
+    # partitions are not discovered from a single file, so the partition is read from its path
+    df = spark_read_parquet(spark, file_path, logger, add_partition_to_cols=True, partition_col="part")
+
+    assert {row.part for row in df.collect()} == {"b"}
+
+
+@pytest.mark.parametrize("add_partition_to_cols", [False, True])
+def test_spark_read_parquet_partition_filter(spark, golden_data, perf_budget, plan_node_count, add_partition_to_cols):
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        df = spark_read_parquet(spark, golden_data["partitioned"], logger, add_partition_to_cols=add_partition_to_cols,
+                                partition_col="part").where("part = 'a'")
+
+        assert _rows(df, "id") == [(1,), (2,)]
+        assert plan_node_count(df, "FileScan") == 1
+        # the filter is pushed to the scan and prunes the part=b folder
+        assert re.search(r"PartitionFilters: \[[^\]]*part#\d+ = a", get_physical_plan(df))
+        files = {row.file.split("/")[-2] for row in df.select(f.input_file_name().alias("file")).collect()}
+        assert files == {"part=a"}
+
+
+def test_spark_read_parquet_date_partition(spark, golden_data, perf_budget):
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        df = spark_read_parquet(spark, golden_data["dated"], logger, add_partition_to_cols=True,
+                                partition_col="dt", date_partition=True, date_format="yyyy-MM-dd")
+
+        assert _rows(df, "id", "dt") == [(1, datetime(2022, 1, 1)), (2, datetime(2022, 1, 2))]
+
+
+def test_spark_read_parquet_schema_drift(spark, golden_data, perf_budget):
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        merged = spark_read_parquet(spark, golden_data["drifted"], logger)
+        schema = StructType(
+            [
+                StructField("id", LongType(), True),
+                StructField("value", DoubleType(), True),
+                StructField("extra", StringType(), True),
+                StructField("missing", StringType(), True),
+            ]
+        )
+        with_schema = spark_read_parquet(spark, golden_data["drifted"], logger, schema=schema)
+
+        assert _rows(merged, "id", "extra", "version") == [(1, None, 1), (2, "new", 2)]
+        assert _rows(with_schema, "id", "extra", "missing") == [(1, None, None), (2, "new", None)]
+
+
+def test_spark_read_parquet_sample_files(spark, golden_data, perf_budget):
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        first = spark_read_parquet(spark, golden_data["partitioned"], logger, sample_files=2, add_file_name_col=True)
+        second = spark_read_parquet(spark, golden_data["partitioned"], logger, sample_files=2)
+
+        assert len({row.filename for row in first.select("filename").collect()}) == 2
+        assert _rows(first, "id", "part") == _rows(second, "id", "part")
+        assert set(_rows(first, "id", "part", "value")) < set(GOLDEN_ROWS)
+
+
+def test_spark_read_parquet_input_files(spark, golden_data, perf_budget):
+    files = [file for file in list_data_files(spark, golden_data["partitioned"]) if "part=b" in file[0]]
+
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        df = spark_read_parquet(spark, golden_data["partitioned"], logger, input_files=files)
+
+        assert _rows(df, "id", "part") == [(3, "b"), (4, "b")]
+
+
+def test_list_data_files_skips_metadata_files(spark, golden_data):
+    files = list_data_files(spark, golden_data["partitioned"])
+
+    assert len(files) == 3
+    assert all(size > 0 for _, size in files)
+    assert not any(os.path.basename(path).startswith("_") for path, _ in files)
+
+
+def test_spark_save_data_csv_header_and_no_header(spark, golden_data, tmp_path, perf_budget):
+    df = spark.read.option("header", "true").schema(GOLDEN_SCHEMA).csv(golden_data["csv_header"])
+    no_header = spark.read.option("header", "false").schema(GOLDEN_SCHEMA).csv(golden_data["csv_no_header"])
+    assert _rows(df, "id", "part", "value") == sorted(GOLDEN_ROWS)
+    assert _rows(no_header, "id", "part", "value") == sorted(GOLDEN_ROWS)
+
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        spark_save_data(df, str(tmp_path / "header"), header="true")
+        spark_save_data(df, str(tmp_path / "no_header"), header="false")
+
+    with open(list_data_files(spark, str(tmp_path / "header"))[0][0].replace("file:", ""), "r") as f:
+        assert f.readline().strip() == "id,part,value"
+    saved = spark.read.schema(GOLDEN_SCHEMA).csv(str(tmp_path / "no_header"))
+    assert _rows(saved, "id", "part", "value") == sorted(GOLDEN_ROWS)
+
+
+def test_spark_save_data_invalid_content_type_raises(spark):
+    with pytest.raises(TypeError):
+        spark_save_data(None, "path", output_content_type="application/json")
+
+
+def test_spark_save_data_partitioned_parquet(spark, tmp_path, perf_budget):
+    output_path = str(tmp_path / "output")
+    df = spark.createDataFrame(GOLDEN_ROWS, GOLDEN_SCHEMA)
+
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        spark_save_data(df, output_path, output_content_type="application/x-parquet", partition_data=True,
+                        partition_col="part")
+
+    assert sorted(name for name in os.listdir(output_path) if not name.startswith(".")) == \
+        ["_SUCCESS", "part=a", "part=b", "part=c"]
+    assert _rows(spark.read.parquet(output_path), "id", "part", "value") == sorted(GOLDEN_ROWS)
+
+
+def test_spark_save_data_run_id_publishes_output(spark, tmp_path):
+    output_path = str(tmp_path / "output")
+    df = spark.createDataFrame(GOLDEN_ROWS, GOLDEN_SCHEMA)
+
+    assert resolve_output_path(spark, output_path) == output_path
+    spark_save_data(df.where("id = 1"), output_path, output_content_type="application/x-parquet", run_id="1")
+    written_path = spark_save_data(df, output_path, output_content_type="application/x-parquet", run_id="2")
+
+    assert written_path.endswith("run_id=2")
+    assert resolve_output_path(spark, output_path).endswith("run_id=2")
+    published = spark_read_parquet(spark, output_path, logger, resolve_published=True)
+    assert _rows(published, "id", "part", "value") == sorted(GOLDEN_ROWS)
+
+    with pytest.raises(ValueError):
+        spark_save_data(df, output_path, mode="append", run_id="3")
+
+
+def test_spark_read_parquet_published_partitions(spark, tmp_path):
+    output_path = str(tmp_path / "output")
+    df = spark.createDataFrame(GOLDEN_ROWS, GOLDEN_SCHEMA)
+    spark_save_data(df, output_path, output_content_type="application/x-parquet", partition_data=True,
+                    partition_col="part", run_id="exec42")
+
+    published = spark_read_parquet(spark, output_path, logger, resolve_published=True, add_partition_to_cols=True,
+                                   partition_col="part")
+
+    assert _rows(published, "id", "part") == [(row[0], row[1]) for row in GOLDEN_ROWS]
+
+
+def test_spark_save_data_removes_old_runs(spark, tmp_path):
+    output_path = str(tmp_path / "output")
+    df = spark.createDataFrame(GOLDEN_ROWS, GOLDEN_SCHEMA)
+    # a run that was never published is kept
+    spark_save_data(df, output_path, output_content_type="application/x-parquet", run_id="0", publish=False)
+    for run_id in ["1", "2", "3"]:
+        spark_save_data(df, output_path, output_content_type="application/x-parquet", run_id=run_id, keep_runs=2)
+
+    assert [os.path.basename(path) for path in get_published_runs(spark, output_path)] == ["run_id=2", "run_id=3"]
+    assert sorted(name for name in os.listdir(output_path) if name.startswith("run_id=")) == \
+        ["run_id=0", "run_id=2", "run_id=3"]
+    assert remove_old_runs(spark, output_path, keep_runs=1)[0].endswith("run_id=2")
+    assert resolve_output_path(spark, output_path).endswith("run_id=3")
+    with pytest.raises(ValueError):
+        remove_old_runs(spark, output_path, keep_runs=0)
+
+
+def test_deduplicate_keeps_latest_row(spark, perf_budget, plan_node_count):
+    df = spark.createDataFrame([(1, 1, "old"), (1, 2, "new"), (2, 1, "only")], "id long, version long, value string")
+
+    with perf_budget(seconds=30):
+        deduplicated = deduplicate(df, ["id"], "version")
+
+        assert _rows(deduplicated, "id", "value") == [(1, "new"), (2, "only")]
+        assert plan_node_count(deduplicated, "Exchange") == 1
+
+
+def test_spark_upsert_data_rewrites_only_affected_partitions(spark, tmp_path, perf_budget):
+    output_path = str(tmp_path / "output")
+    schema = "id long, version long, value string, part string"
+    spark.createDataFrame([(1, 1, "a1", "a"), (2, 1, "b1", "b")], schema) \
+         .write.partitionBy("part").parquet(output_path)
+    untouched_files = sorted(os.listdir(os.path.join(output_path, "part=b")))
+
+    incoming = spark.createDataFrame([(1, 2, "a2", "a"), (1, 2, "a2", "a"), (3, 1, "a3", "a")], schema)
+    with perf_budget(seconds=60):
+        rewritten = spark_upsert_data(incoming, output_path, key_cols=["id"], order_col="version",
+                                      partition_col="part", logger=logger)
+
+    assert rewritten == ["a"]
+    assert sorted(os.listdir(os.path.join(output_path, "part=b"))) == untouched_files
+    assert _rows(spark.read.parquet(output_path), "id", "value", "part") == [
+        (1, "a2", "a"), (2, "b1", "b"), (3, "a3", "a")
+    ]
+
+
+def _assert_session_untouched(session):
+    assert spark_session._spark_session is None
+    assert session.conf.get("spark.sql.shuffle.partitions") == "7"
+
+
+def test_spark_save_inference_input_uses_dataframe_session(caller_session, tmp_path):
+    df = caller_session.createDataFrame([(i, "x") for i in range(10)], "id long, value string")
+
+    spark_save_inference_input(df, str(tmp_path / "inference"), instance_count=1)
+
+    _assert_session_untouched(caller_session)
+
+
+def test_spark_save_inference_input_writes_evenly_sized_files(spark, tmp_path, perf_budget):
+    output_path = str(tmp_path / "inference")
+    df = spark.createDataFrame([(i, "x" * 10) for i in range(100)], "id long, value string")
+
+    with perf_budget(seconds=30):
+        stats = spark_save_inference_input(df, output_path, instance_count=2, files_per_instance=2)
+
+    files = list_data_files(spark, output_path)
+    assert stats["files"] == 4
+    assert stats["records"] == 100
+    assert len(files) == 4
+    assert max(size for _, size in files) - min(size for _, size in files) < 30
+    assert stats["avg_record_bytes"] == sum(size for _, size in files) / 100
+
+
+def test_spark_upsert_data_uses_dataframe_session(caller_session, tmp_path):
+    output_path = str(tmp_path / "output")
+    incoming = caller_session.createDataFrame([(1, 1, "a1", "a")], "id long, version long, value string, part string")
+
+    spark_upsert_data(incoming, output_path, key_cols=["id"], order_col="version", partition_col="part")
+    spark_upsert_data(incoming, output_path, key_cols=["id"], order_col="version", partition_col="part")
+
+    _assert_session_untouched(caller_session)
@@ -0,0 +1,139 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for src.helper.log_utils.py
+"""
+import io
+import json
+import logging
+import threading
+import time
+import uuid
+
+import pytest
+
+from log_utils import BufferedHandler, JsonFormatter, log_stage, setup_logging
+
+
+@pytest.fixture
+def make_logger():
+    handlers = []
+
+    def make(flush_interval=60.0, capacity=1000, **context):
+        stream = io.StringIO()
+        handler = BufferedHandler(stream=stream, flush_interval=flush_interval, capacity=capacity)
+        handler.setFormatter(JsonFormatter(context))
+        handlers.append(handler)
+        # a unique name, so records do not reach the handlers of other tests
+        logger = logging.getLogger(f"test_log_utils.{uuid.uuid4().hex}")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        return logger, stream
+
+    yield make
+    for handler in handlers:
+        handler.close()
+
+
+def _records(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_info_stays_buffered_until_the_flush_interval(make_logger):
+    logger, stream = make_logger(flush_interval=0.2)
+
+    logger.info("first")
+
+    assert stream.getvalue() == ""
+    assert _wait_for(lambda: stream.getvalue() != "")
+    assert [record["message"] for record in _records(stream)] == ["first"]
+
+
+def test_info_flushes_at_capacity(make_logger):
+    logger, stream = make_logger(capacity=3)
+
+    logger.info("first")
+    logger.info("second")
+    assert stream.getvalue() == ""
+
+    logger.info("third")
+    assert [record["message"] for record in _records(stream)] == ["first", "second", "third"]
+
+
+def test_error_flushes_immediately(make_logger):
+    logger, stream = make_logger(component="tests")
+
+    logger.info("buffered")
+    logger.error("failed")
+
+    records = _records(stream)
+    assert [(record["level"], record["message"]) for record in records] == [("INFO", "buffered"), ("ERROR", "failed")]
+    assert all(record["component"] == "tests" for record in records)
+
+
+def test_close_drains_the_buffer(make_logger):
+    logger, stream = make_logger()
+    handler = logger.handlers[0]
+    logger.info("buffered")
+
+    handler.close()
+
+    assert [record["message"] for record in _records(stream)] == ["buffered"]
+    assert _wait_for(lambda: not handler._thread.is_alive())
+
+
+def test_log_stage_context_is_per_thread(make_logger):
+    logger, stream = make_logger()
+    inside = threading.Event()
+    release = threading.Event()
+
+    def run_stage():
+        with log_stage(logger, "worker"):
+            inside.set()
+            release.wait(5)
+            logger.info("in worker")
+
+    thread = threading.Thread(target=run_stage)
+    thread.start()
+    assert inside.wait(5)
+    logger.info("in main")
+    release.set()
+    thread.join()
+    logger.handlers[0].flush()
+
+    stages = {record["message"]: record.get("stage") for record in _records(stream)}
+    assert stages["in main"] is None
+    assert stages["in worker"] == "worker"
+    assert stages["Starting worker"] == "worker"
+    assert [stage for message, stage in stages.items() if message.startswith("Finished worker")] == ["worker"]
+
+
+def test_setup_logging_adds_one_handler():
+    name = f"test_log_utils.{uuid.uuid4().hex}"
+    stream = io.StringIO()
+
+    logger = setup_logging(name, stream=stream, component="tests")
+    assert setup_logging(name) is logger
+
+    handlers = [handler for handler in logger.handlers if isinstance(handler, BufferedHandler)]
+    assert len(handlers) == 1
+    logger.error("failed")
+    assert _records(stream)[0]["component"] == "tests"
+    handlers[0].close()
+    logger.removeHandler(handlers[0])
@@ -0,0 +1,129 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for src.helper.plan_lint.py
+"""
+import logging
+import os
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from pyspark.sql import functions as f
+from pyspark.sql.types import StringType
+
+import spark_session
+from conftest import SAMPLE_DATA_PATH
+from data_utils import spark_read_parquet
+from plan_lint import (
+    has_failures,
+    lint_plan,
+    lint_source,
+    load_entry_point
+)
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture(scope="module")
+def partitioned_path(spark, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("plan_lint") / "partitioned")
+    spark.range(20).withColumn("part", (f.col("id") % 2).cast("string")) \
+        .write.partitionBy("part").parquet(path)
+    return path
+
+
+def _rules(findings):
+    return sorted(finding["rule"] for finding in findings)
+
+
+def test_lint_plan_processing_entry_point_is_clean(spark):
+    process_pyspark = load_entry_point(
+        os.path.join(os.path.dirname(SAMPLE_DATA_PATH), "..", "src", "processing", "process_pyspark.py"))
+
+    assert lint_plan(process_pyspark.main(SAMPLE_DATA_PATH)) == []
+
+
+def test_lint_plan_cartesian_product(spark):
+    df = spark.range(10).crossJoin(spark.range(10))
+
+    findings = lint_plan(df)
+
+    assert _rules(findings) == ["cartesian_product"]
+    assert has_failures(findings)
+
+
+def test_lint_plan_python_udf(spark):
+    to_string = f.udf(lambda value: str(value), StringType())
+    df = spark.range(10).withColumn("value", to_string("id"))
+
+    assert _rules(lint_plan(df)) == ["python_udf"]
+
+
+def test_lint_plan_pushed_and_missing_filters(spark, partitioned_path):
+    pushed = spark.read.parquet(partitioned_path).where("part = '1' and id > 5")
+    # input_file_name is not deterministic, so later filters stay above the scan
+    missing = spark.read.parquet(partitioned_path).withColumn("filename", f.input_file_name()).where("part = '1'")
+
+    assert lint_plan(pushed) == []
+    assert lint_plan(spark_read_parquet(spark, partitioned_path, logger).where("part = '1'")) == []
+    assert _rules(lint_plan(missing)) == ["missing_pushed_filters"]
+    assert not has_failures(lint_plan(missing))
+    assert has_failures(lint_plan(missing), fail_on="warning")
+
+
+def test_lint_plan_repeated_scan(spark, partitioned_path):
+    df = spark.read.parquet(partitioned_path)
+
+    assert _rules(lint_plan(df.union(df))) == ["repeated_scan"]
+    assert lint_plan(df.union(df.where("id > 5"))) == []
+
+
+def test_lint_plan_oversized_broadcast(spark, partitioned_path):
+    df = spark.read.parquet(partitioned_path)
+    joined = df.join(f.broadcast(spark.range(10)), "id")
+
+    assert lint_plan(joined) == []
+    assert _rules(lint_plan(joined, max_broadcast_bytes=1)) == ["oversized_broadcast"]
+
+
+def test_lint_plan_uses_dataframe_session(caller_session):
+    caller_session.conf.set("spark.sql.autoBroadcastJoinThreshold", "1")
+    df = caller_session.range(10).join(f.broadcast(caller_session.range(10)), "id")
+    try:
+        findings = lint_plan(df)
+
+        # the threshold of the dataframe's session is used, and no shared session is created or configured
+        assert _rules(findings) == ["oversized_broadcast"]
+        assert spark_session._spark_session is None
+        assert caller_session.conf.get("spark.sql.shuffle.partitions") == "7"
+    finally:
+        caller_session.conf.unset("spark.sql.autoBroadcastJoinThreshold")
+
+
+def test_lint_source(tmp_path):
+    path = str(tmp_path / "job.py")
+    with open(path, "w") as f_source:
+        f_source.write("rows = df.collect()\n"
+                       "sample = df.limit(10).toPandas()\n"
+                       "pdf = df.select('a').toPandas()\n")
+
+    findings = lint_source(path)
+
+    assert _rules(findings) == ["driver_collect", "driver_collect"]
+    assert findings[0]["message"].endswith(f"collect() at {path}:1")
+    assert findings[1]["message"].endswith(f"toPandas() at {path}:3")
+
+
+def test_has_failures_invalid_severity():
+    with pytest.raises(ValueError):
+        has_failures([], fail_on="info")
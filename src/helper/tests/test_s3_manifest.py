@@ -0,0 +1,179 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for src.helper.s3_manifest.py
+"""
+import hashlib
+import io
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+
+from s3_manifest import (
+    build_manifest,
+    get_manifest_files,
+    load_or_build_manifest,
+    read_bytes,
+    split_s3_uri
+)
+
+logger = logging.getLogger(__name__)
+
+DATA_KEYS = [
+    "data/part=a/f1.parquet",
+    "data/part=a/f2.parquet",
+    "data/part=b/f3.parquet",
+]
+HIDDEN_KEYS = [
+    "data/_SUCCESS",
+    "data/part=a/.f1.parquet.crc",
+    "data/part=b/_committed_123",
+]
+
+
+class FakeS3Client:
+    """
+    In memory stand-in for the s3 client calls used by s3_manifest, with small pages to exercise pagination
+    """
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.objects = {}
+        self.listings = []
+        self._clock = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+    def put_object(self, Bucket, Key, Body=b""):
+        # every write gets a later LastModified, like s3
+        self._clock += timedelta(seconds=1)
+        self.objects[(Bucket, Key)] = {"Body": Body, "ETag": f'"{hashlib.md5(Body).hexdigest()}"',
+                                       "LastModified": self._clock}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key))
+
+    def _get(self, Bucket, Key, operation):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, operation)
+        return self.objects[(Bucket, Key)]
+
+    def head_object(self, Bucket, Key):
+        obj = self._get(Bucket, Key, "HeadObject")
+        return {"ETag": obj["ETag"], "LastModified": obj["LastModified"], "ContentLength": len(obj["Body"])}
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self._get(Bucket, Key, "GetObject")["Body"])}
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        self.listings.append((Prefix, Delimiter))
+        contents, common_prefixes = [], set()
+        for bucket, key in sorted(self.objects):
+            if bucket != Bucket or not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common_prefixes.add(Prefix + rest.split(Delimiter, 1)[0] + Delimiter)
+            else:
+                obj = self.objects[(bucket, key)]
+                contents.append({"Key": key, "Size": len(obj["Body"]), "ETag": obj["ETag"]})
+        for i in range(0, max(len(contents), 1), self.page_size):
+            page = {"Contents": contents[i:i + self.page_size]}
+            if i == 0:
+                page["CommonPrefixes"] = [{"Prefix": prefix} for prefix in sorted(common_prefixes)]
+            yield page
+
+
+@pytest.fixture
+def s3_client():
+    client = FakeS3Client()
+    for key in DATA_KEYS:
+        client.put_object(Bucket="bucket", Key=key, Body=b"data of " + key.encode("utf-8"))
+    for key in HIDDEN_KEYS:
+        client.put_object(Bucket="bucket", Key=key, Body=b"")
+    return client
+
+
+def _keys(manifest):
+    return [relative_key for relative_key, _, _, _ in manifest["files"]]
+
+
+def test_split_s3_uri():
+    assert split_s3_uri("s3a://bucket/data/part=a") == ("s3a", "bucket", "data/part=a")
+    with pytest.raises(ValueError):
+        split_s3_uri("/local/data")
+
+
+def test_build_manifest_lists_sub_prefixes_in_parallel(s3_client):
+    manifest = build_manifest("s3://bucket/data", s3_client=s3_client, max_workers=4, fanout_depth=1)
+
+    assert _keys(manifest) == ["part=a/f1.parquet", "part=a/f2.parquet", "part=b/f3.parquet"]
+    assert manifest["files"][0][1] == len(b"data of data/part=a/f1.parquet")
+    assert manifest["files"][0][3] == {"part": "a"}
+    # one delimited listing of the root, then one recursive listing per partition
+    assert sorted(s3_client.listings) == [("data/", "/"), ("data/part=a/", None), ("data/part=b/", None)]
+
+
+def test_build_manifest_single_object(s3_client):
+    manifest = build_manifest("s3://bucket/data/part=b/f3.parquet", s3_client=s3_client)
+
+    assert manifest["prefix"] == "data/part=b/"
+    assert _keys(manifest) == ["f3.parquet"]
+    assert get_manifest_files(manifest) == [("s3://bucket/data/part=b/f3.parquet", 30)]
+
+
+def test_get_manifest_files_partition_values(s3_client):
+    manifest = build_manifest("s3a://bucket/data/", s3_client=s3_client)
+
+    files = get_manifest_files(manifest, partition_values={"part": ["b"]})
+
+    assert files == [("s3a://bucket/data/part=b/f3.parquet", 30)]
+    assert len(get_manifest_files(manifest)) == 3
+    assert get_manifest_files(manifest, partition_values={"part": ["z"]}) == []
+
+
+def test_load_or_build_manifest_reuses_until_marker_is_rewritten(s3_client, tmp_path):
+    manifest_uri = str(tmp_path / "manifest.json.gz")
+    first = load_or_build_manifest("s3://bucket/data", manifest_uri, logger=logger, s3_client=s3_client)
+
+    s3_client.listings = []
+    reused = load_or_build_manifest("s3://bucket/data", manifest_uri, logger=logger, s3_client=s3_client)
+    assert reused == first
+    assert s3_client.listings == []
+
+    # rewrite the prefix: the new zero byte _SUCCESS has the same ETag as the old one
+    s3_client.delete_object(Bucket="bucket", Key="data/part=a/f1.parquet")
+    s3_client.put_object(Bucket="bucket", Key="data/part=c/f4.parquet", Body=b"new data")
+    s3_client.put_object(Bucket="bucket", Key="data/_SUCCESS", Body=b"")
+
+    rebuilt = load_or_build_manifest("s3://bucket/data", manifest_uri, logger=logger, s3_client=s3_client)
+    assert _keys(rebuilt) == ["part=a/f2.parquet", "part=b/f3.parquet", "part=c/f4.parquet"]
+
+
+def test_load_or_build_manifest_without_marker(s3_client, tmp_path):
+    manifest_uri = str(tmp_path / "manifest.json.gz")
+    s3_client.delete_object(Bucket="bucket", Key="data/_SUCCESS")
+    load_or_build_manifest("s3://bucket/data", manifest_uri, s3_client=s3_client)
+
+    s3_client.listings = []
+    load_or_build_manifest("s3://bucket/data", manifest_uri, s3_client=s3_client, max_age_seconds=3600)
+    assert s3_client.listings == []
+
+    load_or_build_manifest("s3://bucket/data", manifest_uri, s3_client=s3_client)
+    assert s3_client.listings != []
+
+
+def test_read_bytes_missing_file(s3_client, tmp_path):
+    assert read_bytes("s3://bucket/data/missing", s3_client=s3_client) is None
+    assert read_bytes(str(tmp_path / "missing")) is None
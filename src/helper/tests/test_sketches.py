@@ -0,0 +1,195 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for src.helper.sketches.py
+"""
+import json
+import math
+import random
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from sketches import (
+    CountMinSketch,
+    HyperLogLog,
+    KllSketch,
+    SketchSet,
+    compute_sketches,
+    load_sketches,
+    update_sketches
+)
+
+PROBABILITIES = [0.01, 0.25, 0.5, 0.75, 0.99]
+
+
+def _shuffled(n, seed=0):
+    values = list(range(n))
+    random.Random(seed).shuffle(values)
+    return values
+
+
+def _round_trip(sketch):
+    return type(sketch).from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+
+@pytest.mark.parametrize("cardinality", [100, 10000, 200000])
+def test_hyperloglog_relative_error(cardinality):
+    sketch = HyperLogLog()
+    sketch.add_values(list(range(cardinality)) * 2)
+
+    # about 4 standard errors of 1.04 / sqrt(2 ** 14)
+    assert abs(sketch.count() - cardinality) / cardinality < 0.035
+
+
+def test_hyperloglog_merge_overlapping_sets():
+    first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    first.add_values(range(0, 60000))
+    second.add_values(range(40000, 100000))
+    union.add_values(range(0, 100000))
+
+    merged = first.merge(second)
+
+    assert merged.registers == union.registers
+    assert abs(merged.count() - 100000) / 100000 < 0.035
+    with pytest.raises(ValueError):
+        merged.merge(HyperLogLog(precision=10))
+
+
+def test_hyperloglog_add_matches_add_values():
+    one_by_one, batch = HyperLogLog(), HyperLogLog()
+    for value in ["a", 1, 2.5]:
+        one_by_one.add(value)
+    batch.add_values(["a", 1, 2.5])
+
+    assert one_by_one.registers == batch.registers
+    assert one_by_one.count() == 3
+
+
+def test_kll_quantile_rank_error():
+    n = 100000
+    sketch = KllSketch(seed=1)
+    values = _shuffled(n)
+    for value in values[:1000]:
+        sketch.add(value)
+    sketch.add_values(values[1000:])
+
+    quantiles = sketch.quantiles(PROBABILITIES)
+
+    assert sketch.n == n
+    # values are 0..n-1, so the rank of a value is value / n
+    assert all(abs(quantile / n - probability) < 0.02 for quantile, probability in zip(quantiles, PROBABILITIES))
+    assert KllSketch().quantiles([0.5]) == [None]
+
+
+def test_kll_merge_many_partial_sketches():
+    n, partitions = 100000, 50
+    values = _shuffled(n)
+    merged = KllSketch(seed=1)
+    for i in range(partitions):
+        partial = KllSketch(seed=i)
+        partial.add_values(values[i::partitions])
+        merged.merge(partial)
+
+    quantiles = merged.quantiles(PROBABILITIES)
+
+    assert merged.n == n
+    assert sum(len(compactor) for compactor in merged.compactors) < 4 * merged.k
+    assert all(abs(quantile / n - probability) < 0.02 for quantile, probability in zip(quantiles, PROBABILITIES))
+
+
+def test_count_min_heavy_hitter_ranking():
+    # value i appears 10000 / i times among 20000 values seen once
+    counts = {f"hot{i}": 10000 // i for i in range(1, 51)}
+    values = [value for value, count in counts.items() for _ in range(count)] + [f"cold{i}" for i in range(20000)]
+    random.Random(0).shuffle(values)
+    sketch = CountMinSketch(top_k=5)
+    for i in range(0, len(values), 5000):
+        sketch.add_values(values[i:i + 5000])
+
+    heavy_hitters = sketch.heavy_hitters()
+
+    assert [value for value, _ in heavy_hitters] == ["hot1", "hot2", "hot3", "hot4", "hot5"]
+    assert sketch.total == len(values)
+    max_error = math.e / sketch.width * sketch.total
+    assert all(counts[value] <= estimate <= counts[value] + max_error for value, estimate in heavy_hitters)
+
+
+def test_count_min_merge_keeps_heavy_hitters_of_both_sketches():
+    first, second = CountMinSketch(top_k=2), CountMinSketch(top_k=2)
+    first.add_values(["a"] * 10 + ["b"] * 3)
+    second.add_values(["c"] * 8 + ["b"] * 3)
+    second.add("d", count=2)
+
+    merged = first.merge(second)
+
+    assert merged.heavy_hitters() == [("a", 10), ("c", 8)]
+    assert merged.estimate("b") == 6
+    assert merged.total == 26
+
+
+def test_sketch_to_dict_from_dict_round_trip():
+    hll, kll, cms = HyperLogLog(precision=10), KllSketch(k=50), CountMinSketch(width=64, depth=3, top_k=3)
+    for sketch in [hll, kll, cms]:
+        sketch.add_values(_shuffled(5000))
+
+    for sketch in [hll, kll, cms]:
+        assert _round_trip(sketch).to_dict() == sketch.to_dict()
+    assert _round_trip(hll).count() == hll.count()
+    assert _round_trip(kll).quantiles(PROBABILITIES) == kll.quantiles(PROBABILITIES)
+    assert _round_trip(cms).heavy_hitters() == cms.heavy_hitters()
+
+    sketch_set = SketchSet(distinct_cols=["a"], quantile_cols=["a", "b"], heavy_hitter_cols=["b"])
+    sketch_set.add_row({"a": 1, "b": None})
+    assert _round_trip(sketch_set).summary() == sketch_set.summary()
+
+
+def test_compute_sketches_matches_local_sketches(spark):
+    rows = [(i % 100 if i % 7 else None, float(i), f"v{i % 3}") for i in range(1000)]
+    df = spark.createDataFrame(rows, "a int, b double, c string").repartition(4)
+
+    sketch_set = compute_sketches(df, distinct_cols=["a", "c"], quantile_cols=["b"], heavy_hitter_cols=["a", "c"])
+
+    # integer columns with nulls are hashed like python integers, not like pandas floats
+    expected = HyperLogLog()
+    expected.add_values([a for a, _, _ in rows if a is not None])
+    assert sketch_set.sketches["distinct"]["a"].registers == expected.registers
+    summary = sketch_set.summary()
+    assert summary["distinct"] == {"a": 100, "c": 3}
+    assert summary["quantiles"]["b"][0.5] == pytest.approx(500, abs=20)
+    assert summary["heavy_hitters"]["c"] == [("v0", 334), ("v1", 333), ("v2", 333)]
+
+
+def test_compute_sketches_empty_dataframe(spark):
+    df = spark.createDataFrame([], "a int, b double")
+
+    summary = compute_sketches(df, distinct_cols=["a"], quantile_cols=["b"], heavy_hitter_cols=["a"]).summary()
+
+    assert summary["distinct"] == {"a": 0}
+    assert summary["quantiles"] == {"b": {probability: None for probability in PROBABILITIES}}
+    assert summary["heavy_hitters"] == {"a": []}
+
+
+def test_update_sketches_merges_increments(spark, tmp_path):
+    uri = str(tmp_path / "sketches.json.gz")
+    first = spark.createDataFrame([(i, f"v{i % 2}") for i in range(0, 600)], "id long, value string")
+    second = spark.createDataFrame([(i, "v2") for i in range(400, 1000)], "id long, value string")
+
+    update_sketches(first, uri, distinct_cols=["id"], quantile_cols=["id"], heavy_hitter_cols=["value"])
+    sketch_set = update_sketches(second, uri, distinct_cols=["id"], quantile_cols=["id"],
+                                 heavy_hitter_cols=["value"])
+
+    summary = sketch_set.summary()
+    assert summary["distinct"]["id"] == pytest.approx(1000, rel=0.035)
+    assert sketch_set.sketches["quantiles"]["id"].n == 1200
+    assert summary["heavy_hitters"]["value"] == [("v2", 600), ("v0", 300), ("v1", 300)]
+    assert load_sketches(uri).summary() == summary
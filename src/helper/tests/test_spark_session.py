@@ -0,0 +1,74 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for src.helper.spark_session.py
+"""
+import json
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from spark_session import (
+    S3A_COMMITTERS,
+    get_cluster_size,
+    get_shuffle_partitions,
+    get_spark_session,
+    get_spark_settings
+)
+
+
+def test_get_cluster_size(tmp_path):
+    resource_config_path = str(tmp_path / "resourceconfig.json")
+    with open(resource_config_path, "w") as f:
+        json.dump({"current_host": "algo-1", "hosts": ["algo-1", "algo-2", "algo-3"]}, f)
+
+    assert get_cluster_size(resource_config_path) == 3
+    assert get_cluster_size(str(tmp_path / "missing.json")) == 1
+
+
+def test_get_shuffle_partitions():
+    assert get_shuffle_partitions(instance_count=2, cores_per_instance=8) == 48
+    assert get_shuffle_partitions(instance_count=2, cores_per_instance=8, partitions_per_core=1) == 16
+    assert get_shuffle_partitions(instance_count=1) >= 3
+
+
+def test_get_spark_settings_profiles():
+    local = get_spark_settings(profile="local")
+    default = get_spark_settings(profile="default", conf={"spark.sql.adaptive.enabled": "false"})
+
+    assert local["spark.master"] == "local[2]"
+    assert local["spark.sql.shuffle.partitions"] == "4"
+    assert default["spark.sql.adaptive.enabled"] == "false"
+    assert int(default["spark.sql.shuffle.partitions"]) == get_shuffle_partitions(get_cluster_size())
+    assert not any(key.startswith("spark.hadoop.mapreduce.fileoutputcommitter") for key in default)
+
+
+@pytest.mark.parametrize("committer", list(S3A_COMMITTERS))
+def test_get_spark_settings_committers(committer):
+    settings = get_spark_settings(committer=committer)
+
+    assert settings["spark.hadoop.fs.s3a.committer.name"] == committer
+    assert settings["spark.sql.sources.commitProtocolClass"].endswith("PathOutputCommitProtocol")
+
+
+def test_get_spark_settings_invalid_arguments():
+    with pytest.raises(ValueError, match="Invalid spark profile"):
+        get_spark_settings(profile="unknown")
+    with pytest.raises(ValueError, match="Invalid s3a committer"):
+        get_spark_settings(committer="unknown")
+
+
+def test_get_spark_session_is_shared(spark):
+    assert get_spark_session(profile="default") is spark
+    assert spark.conf.get("spark.sql.shuffle.partitions") == "4"
+    with pytest.raises(ValueError):
+        get_spark_session(profile="unknown")
@@ -15,73 +15,335 @@ Description: Example of pre-processing code using a PySpark processor
               * read parameters from the processing job
               * read parquet data from s3
               * save data to s3
-              * set logs to be displayed with the start of the job execution
+              * emit structured logs without flushing stdout on every line
               * use extra helper python files
               * Add extra parameters to SageMaker Experiments
+              * dry run the job on a sample of the input files to project a full run
+              * read the input files from a manifest instead of listing the input prefix
+              * create a tuned spark session shared with the helper functions
+              * publish the output atomically so downstream steps never read partial data
+              * write evenly sized batch transform input files
+              * process many tables concurrently in the same spark application
 """
 
 # import requirements
 import argparse
-import logging
-import sys
+import json
 import os
+import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 # spark imports
-from pyspark.sql import SparkSession
 from pyspark.sql.functions import (udf, col)
 from pyspark.sql.types import StringType, StructField, StructType, FloatType
 
 from data_utils import(
     spark_read_parquet,
-    Unbuffered
+    list_data_files,
+    sample_input_files,
+    project_full_run,
+    spark_save_data,
+    spark_save_inference_input,
+    get_run_output_path,
+    publish_output,
+    remove_old_runs
+)
+from spark_session import get_spark_session
+from s3_manifest import (
+    load_or_build_manifest,
+    get_manifest_files,
+    is_s3_uri,
+    read_bytes
 )
 
-sys.stdout = Unbuffered(sys.stdout)
-
-# Define custom handler
-logger = logging.getLogger(__name__)
-handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
-
-def main(data_path):
-
-    spark = SparkSession.builder.appName("PySparkJob").getOrCreate()
-    spark.sparkContext.setLogLevel("ERROR")
-
-    schema = StructType(
-        [
-            StructField("sex", StringType(), True),
-            StructField("length", FloatType(), True),
-            StructField("diameter", FloatType(), True),
-            StructField("height", FloatType(), True),
-            StructField("whole_weight", FloatType(), True),
-            StructField("shucked_weight", FloatType(), True),
-            StructField("viscera_weight", FloatType(), True),
-            StructField("rings", FloatType(), True),
-        ]
-    )
+from log_utils import (
+    setup_logging,
+    log_stage
+)
+
+# json logs flushed in batches, with errors flushed immediately
+logger = setup_logging(__name__, component="pyspark-processing")
+
+ABALONE_SCHEMA = StructType(
+    [
+        StructField("sex", StringType(), True),
+        StructField("length", FloatType(), True),
+        StructField("diameter", FloatType(), True),
+        StructField("height", FloatType(), True),
+        StructField("whole_weight", FloatType(), True),
+        StructField("shucked_weight", FloatType(), True),
+        StructField("viscera_weight", FloatType(), True),
+        StructField("rings", FloatType(), True),
+    ]
+)
+ABALONE_COLUMNS = ["sex", "length", "diameter", "rings"]
+# target of the model, left out of the inference input
+LABEL_COLUMN = "rings"
+
+# folder of the output with the parquet training data, read by the training channel of the pipeline
+TRAINING_DATA_FOLDER = "train"
+
+# schemas that can be referenced by name in a datasets manifest
+SCHEMAS = {
+    "abalone": ABALONE_SCHEMA
+}
+
+
+def main(data_path, schema=ABALONE_SCHEMA, columns=ABALONE_COLUMNS):
+
+    spark = get_spark_session(app_name="PySparkJob")
 
     df = spark.read.csv(data_path, header=False, schema=schema)
-    return df.select("sex", "length", "diameter", "rings")
+    return df.select(*columns) if columns else df
 
-if __name__ == "__main__":
-    logger.info(f"===============================================================")
-    logger.info(f"================= Starting pyspark-processing =================")
+
+def write_output(df, output_table, run_id=None, output_files=None, keep_runs=2):
+    with log_stage(logger, "write " + output_table):
+        # evenly sized files so that every training instance of a sharded channel gets the same amount of data
+        parquet_df = df.repartition(output_files) if output_files else df.coalesce(10)
+
+        # save data. With a run_id the data is staged in a run folder and published once the csv is written too
+        output_path = get_run_output_path(output_table, run_id) if run_id is not None else output_table
+        # the training channel reads the parquet folder, so it holds nothing but the parquet files
+        spark_save_data(parquet_df, os.path.join(output_path, TRAINING_DATA_FOLDER),
+                        output_content_type="application/x-parquet", success_marker=False, logger=logger)
+
+        logger.info("Writing transformed data")
+        df.write.csv(os.path.join(output_path, "transformed.csv"), header=True, mode="overwrite")
+
+        if run_id is not None:
+            spark = df.sql_ctx.sparkSession
+            publish_output(spark, output_table, run_id, logger=logger)
+            remove_old_runs(spark, output_table, keep_runs=keep_runs, logger=logger)
+
+
+def write_inference_input(df, inference_output, instance_count):
+    """
+    Write the batch transform input: the columns of the output without the label, in the same order
+    Args:
+        df (pyspark.sql.DataFrame): processed data
+        inference_output (str): path to write the inference input to
+        instance_count (int): number of transform instances
+    Returns:
+        (dict): inference input stats as returned by spark_save_inference_input
+    """
+    return spark_save_inference_input(df.drop(LABEL_COLUMN), inference_output, instance_count=instance_count,
+                                      logger=logger)
+
+
+def dry_run(data_path, output_table, sample_fraction=None, sample_files=None, files=None):
+    """
+    Run the full transformation on a deterministic subset of the input files and project the runtime
+    and output size of a run over the full input. The fixed cost of a run is measured by running the same
+    job over no rows first, and only the rest of the sampled runtime is scaled with the input size
+    Args:
+        data_path (str): path to the full input data
+        output_table (str): path to write the sampled output to
+        sample_fraction (float): fraction of the input files to process
+        sample_files (int): number of input files to process
+        files (list[tuple]): list of (file path, size in bytes) of the full input. If not provided, data_path is listed
+    Returns:
+        (dict): projection of the full run as returned by project_full_run
+    """
+    spark = get_spark_session(app_name="PySparkJob")
+    files = files if files is not None else list_data_files(spark, data_path)
+    sampled_files = sample_input_files(files, sample_fraction=sample_fraction, sample_files=sample_files)
+    logger.info(f"Dry run on {len(sampled_files)} of {len(files)} input files")
+    if len(sampled_files) == len(files):
+        logger.warning(f"The dry run sample is the full input of {len(files)} files, so the projection is the "
+                       f"sampled run itself. Split the input into more files to project a larger run")
+
+    sampled_paths = [file_path for file_path, _ in sampled_files]
+    # the run over no rows also warms up the session, so the warm up is not scaled either
+    start = time.time()
+    write_output(main(sampled_paths).limit(0), output_table)
+    fixed_runtime = time.time() - start
+
+    start = time.time()
+    df = main(sampled_paths)
+    write_output(df, output_table)
+    runtime = time.time() - start
+
+    projection = project_full_run(
+        total_input_bytes=sum(size for _, size in files),
+        sample_input_bytes=sum(size for _, size in sampled_files),
+        sample_runtime_seconds=runtime,
+        sample_output_bytes=sum(size for _, size in list_data_files(spark, output_table)),
+        fixed_runtime_seconds=fixed_runtime
+    )
+    logger.info(f"Sampled run took {runtime:.1f}s. Projected full run: {projection}")
+    return projection
+
+
+def get_schema(schema):
+    """
+    Get the schema of a datasets manifest entry
+    Args:
+        schema (str or dict): name of a schema in SCHEMAS or a spark schema in json format (StructType.jsonValue())
+    Returns:
+        (StructType): spark schema
+    """
+    if isinstance(schema, dict):
+        return StructType.fromJson(schema)
+    if schema not in SCHEMAS:
+        raise ValueError(f"Invalid schema name. Found {schema}. Allowed values: {list(SCHEMAS)}")
+    return SCHEMAS[schema]
+
+
+def process_table(entry, pool_name, run_id=None, keep_runs=2):
+    """
+    Process one table of a datasets manifest in its own FAIR scheduler pool
+    Args:
+        entry (dict): manifest entry with input, schema, output and optionally the list of columns to keep
+        pool_name (str): FAIR scheduler pool for the spark jobs of the table
+        run_id (str): if provided, the output is written to a run_id folder and published atomically
+        keep_runs (int): number of most recent published runs kept. Only used with run_id
+    Returns:
+        (dict): input, output, status (succeeded or failed), runtime in seconds and error message
+    """
+    spark = get_spark_session(app_name="PySparkJob")
+    # local properties are per thread, so every table runs its jobs in its own pool
+    spark.sparkContext.setLocalProperty("spark.scheduler.pool", pool_name)
+    start = time.time()
+    result = {"input": entry.get("input"), "output": entry.get("output"), "status": "succeeded", "error": None}
+    try:
+        with log_stage(logger, "table " + entry["input"]):
+            df = main(entry["input"], schema=get_schema(entry["schema"]), columns=entry.get("columns"))
+            write_output(df, entry["output"], run_id=run_id, keep_runs=keep_runs)
+    except Exception as error:
+        logger.exception(f"Failed to process {entry.get('input')}")
+        result.update({"status": "failed", "error": str(error)})
+    finally:
+        spark.sparkContext.setLocalProperty("spark.scheduler.pool", None)
+    result["seconds"] = round(time.time() - start, 1)
+    logger.info(f"Processed table: {result}")
+    return result
+
+
+def process_datasets(datasets_manifest, max_parallel_tables=4, run_id=None, keep_runs=2):
+    """
+    Process all the tables of a datasets manifest concurrently inside the same spark application.
+    The manifest is a json list of entries as {"input": path, "schema": name or json schema, "output": path}
+    Args:
+        datasets_manifest (str): s3 uri or local path of the datasets manifest
+        max_parallel_tables (int): number of tables processed at the same time
+        run_id (str): if provided, every output is written to a run_id folder and published atomically
+        keep_runs (int): number of most recent published runs kept for every output. Only used with run_id
+    Returns:
+        (list[dict]): result of every table as returned by process_table
+    """
+    data = read_bytes(datasets_manifest)
+    if data is None:
+        raise ValueError(f"Datasets manifest not found: {datasets_manifest}")
+    entries = json.loads(data)
+    logger.info(f"Processing {len(entries)} tables with up to {max_parallel_tables} in parallel")
+
+    with ThreadPoolExecutor(max_workers=max_parallel_tables) as pool:
+        futures = [pool.submit(process_table, entry, f"table_{i}", run_id=run_id, keep_runs=keep_runs)
+                   for i, entry in enumerate(entries)]
+        results = [future.result() for future in futures]
+
+    failed = [result for result in results if result["status"] == "failed"]
+    logger.info(f"{len(results) - len(failed)} tables succeeded, {len(failed)} tables failed")
+    if failed:
+        raise RuntimeError(f"Failed to process {len(failed)} of {len(results)} tables: {failed}")
+    return results
+
+
+# arguments only used when processing a single table
+SINGLE_TABLE_ARGUMENTS = ["sample_fraction", "sample_files", "output_files", "inference_output"]
+
+
+def parse_args(argv=None):
+    """
+    Parse the job arguments. Arguments that only apply to a single table are rejected with --datasets_manifest
+    Args:
+        argv (list[str]): arguments to parse. Default sys.argv
+    Returns:
+        (argparse.Namespace): job arguments
+    """
     parser = argparse.ArgumentParser(description="app inputs")
     parser.add_argument("--input_table", type=str, help="path to the channel data")
     parser.add_argument("--output_table", type=str, help="path to the output data")
-    args = parser.parse_args()
-    
-    df = main(args.input_table)
+    parser.add_argument("--sample_fraction", type=float, default=None,
+                        help="dry run: fraction of the input files to process")
+    parser.add_argument("--sample_files", type=int, default=None,
+                        help="dry run: number of input files to process")
+    parser.add_argument("--input_manifest", type=str, default=None,
+                        help="path to the manifest with the input files. Built on the first run and reused "
+                             "while the input prefix is unchanged")
+    parser.add_argument("--input_manifest_max_age", type=int, default=None,
+                        help="maximum age in seconds of an input manifest to be reused when the input prefix has no "
+                             "_SUCCESS marker, e.g. a single input file")
+    parser.add_argument("--spark_profile", type=str, default="default",
+                        help="spark session settings profile. Allowed values: default or local")
+    parser.add_argument("--committer", type=str, default=None,
+                        help="s3a committer to write the output with. Allowed values: magic, partitioned or directory")
+    parser.add_argument("--run_id", type=str, default=None,
+                        help="if provided, the output is written to a run_id folder and published atomically")
+    parser.add_argument("--keep_runs", type=int, default=2,
+                        help="number of most recent published runs kept when --run_id is provided")
+    parser.add_argument("--output_files", type=int, default=None,
+                        help="number of parquet files to write, e.g. a multiple of the training instance count")
+    parser.add_argument("--inference_output", type=str, default=None,
+                        help="if provided, path to write the batch transform input to")
+    parser.add_argument("--inference_files", type=int, default=1,
+                        help="number of batch transform input files, e.g. a multiple of the transform instance count")
+    parser.add_argument("--datasets_manifest", type=str, default=None,
+                        help="if provided, path to a json list of (input, schema, output) tables processed "
+                             "concurrently instead of --input_table/--output_table")
+    parser.add_argument("--max_parallel_tables", type=int, default=4,
+                        help="number of tables of the datasets manifest processed at the same time")
+    args = parser.parse_args(argv)
+
+    if args.datasets_manifest:
+        unsupported = [f"--{name}" for name in SINGLE_TABLE_ARGUMENTS if getattr(args, name) is not None]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --datasets_manifest")
+        if args.input_table or args.output_table or args.input_manifest or args.input_manifest_max_age:
+            logger.warning("Ignoring --input_table, --output_table and --input_manifest: the tables are read from "
+                           "--datasets_manifest")
+    elif not (args.input_table and args.output_table):
+        parser.error("--input_table and --output_table are required without --datasets_manifest")
+    return args
+
+
+if __name__ == "__main__":
+    logger.info(f"===============================================================")
+    logger.info(f"================= Starting pyspark-processing =================")
+    args = parse_args()
+
+    # create the session shared by the job and its helper functions
+    # FAIR scheduling lets the tables of a datasets manifest share the cluster instead of queueing
+    get_spark_session(app_name="PySparkJob", profile=args.spark_profile, committer=args.committer,
+                      conf={"spark.scheduler.mode": "FAIR"} if args.datasets_manifest else None)
 
-    logger.info("Writing transformed data")
-    df.write.csv(os.path.join(args.output_table, "transformed.csv"), header=True, mode="overwrite")
+    input_files = None
+    # the input manifest lists --input_table, which is not read in datasets manifest mode
+    if args.input_manifest and not args.datasets_manifest:
+        if is_s3_uri(args.input_table):
+            manifest = load_or_build_manifest(args.input_table, args.input_manifest, logger=logger,
+                                              max_age_seconds=args.input_manifest_max_age)
+            input_files = get_manifest_files(manifest)
+        else:
+            # local runs list the input folder directly, the manifest only saves s3 listings
+            logger.warning(f"Ignoring --input_manifest for the local input {args.input_table}")
+            input_files = list_data_files(None, args.input_table)
 
-    # save data
-    df.coalesce(10).write.mode("overwrite").parquet(args.output_table)
+    if args.datasets_manifest:
+        process_datasets(args.datasets_manifest, max_parallel_tables=args.max_parallel_tables, run_id=args.run_id,
+                         keep_runs=args.keep_runs)
+    elif (args.sample_fraction is not None) or (args.sample_files is not None):
+        # never overwrite the real output with sampled data
+        dry_run(args.input_table, args.output_table.rstrip("/") + "_dry_run",
+                sample_fraction=args.sample_fraction, sample_files=args.sample_files, files=input_files)
+    else:
+        df = main([file_path for file_path, _ in input_files] if input_files else args.input_table)
+        write_output(df, args.output_table, run_id=args.run_id, output_files=args.output_files,
+                     keep_runs=args.keep_runs)
+        if args.inference_output:
+            write_inference_input(df, args.inference_output, instance_count=args.inference_files)
 
     logger.info(f"================== Ending pyspark-processing ==================")
     logger.info(f"===============================================================")
@@ -0,0 +1,164 @@
+"""
+ Copyright 2021 Amazon Web Services, Inc. or its affiliates. All Rights Reserved.
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at https://www.apache.org/licenses/LICENSE-2.0
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Description: Tests for src.processing.process_pyspark.py
+"""
+import json
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from conftest import SAMPLE_DATA_PATH
+from data_utils import resolve_output_path
+from process_pyspark import (
+    ABALONE_COLUMNS,
+    TRAINING_DATA_FOLDER,
+    dry_run,
+    main,
+    parse_args,
+    process_datasets,
+    write_inference_input,
+    write_output
+)
+
+
+def test_main_reads_abalone_columns(spark, perf_budget, plan_node_count):
+    with perf_budget(seconds=30, shuffle_bytes=0):
+        df = main(SAMPLE_DATA_PATH)
+
+        assert df.columns == ABALONE_COLUMNS
+        assert len(df.collect()) == 4178
+        assert plan_node_count(df, "FileScan") == 1
+        assert plan_node_count(df, "Exchange") == 0
+
+
+def test_write_output_parquet(spark, tmp_path, perf_budget):
+    output_table = str(tmp_path / "output")
+    df = main(SAMPLE_DATA_PATH)
+
+    with perf_budget(seconds=60):
+        write_output(df, output_table, output_files=2)
+
+    training_data = os.path.join(output_table, TRAINING_DATA_FOLDER)
+    assert spark.read.parquet(training_data).count() == 4178
+    assert spark.read.csv(os.path.join(output_table, "transformed.csv"), header=True).count() == 4178
+
+
+def test_write_output_training_channel_holds_only_parquet_files(spark, tmp_path):
+    output_table = str(tmp_path / "output")
+
+    write_output(main(SAMPLE_DATA_PATH), output_table, run_id="1", output_files=3)
+
+    # a channel sharded by s3 key splits every object of its prefix between the instances
+    # (.crc checksums are only written by the local file system)
+    channel = os.path.join(output_table, "run_id=1", TRAINING_DATA_FOLDER)
+    objects = [name for name in os.listdir(channel) if not name.endswith(".crc")]
+    assert len(objects) == 3
+    assert all(name.startswith("part-") and name.endswith(".parquet") for name in objects)
+
+
+def test_write_output_run_id(spark, tmp_path):
+    output_table = str(tmp_path / "output")
+    df = main(SAMPLE_DATA_PATH)
+
+    for run_id in ["1", "2"]:
+        write_output(df, output_table, run_id=run_id, keep_runs=1)
+
+    run_path = resolve_output_path(spark, output_table)
+    assert run_path.endswith("run_id=2")
+    assert sorted(name for name in os.listdir(output_table) if not name.startswith(".")) == \
+        ["_CURRENT", "_RUNS", "run_id=2"]
+    assert spark.read.csv(os.path.join(run_path, "transformed.csv"), header=True).count() == 4178
+    assert spark.read.parquet(os.path.join(run_path, TRAINING_DATA_FOLDER)).count() == 4178
+
+
+def test_write_inference_input_leaves_out_the_label(spark, tmp_path):
+    inference_output = str(tmp_path / "inference")
+
+    stats = write_inference_input(main(SAMPLE_DATA_PATH), inference_output, instance_count=2)
+
+    assert stats["files"] == 2
+    records = spark.read.csv(inference_output, header=False)
+    assert records.count() == 4178
+    # sex, length and diameter, without rings
+    assert len(records.columns) == 3
+
+
+def test_dry_run_projects_full_run(spark, tmp_path):
+    input_path = tmp_path / "input"
+    input_path.mkdir()
+    for name in ["first.csv", "second.csv"]:
+        shutil.copy(SAMPLE_DATA_PATH, input_path / name)
+
+    projection = dry_run(str(input_path), str(tmp_path / "dry_run"), sample_files=1)
+
+    assert projection["scale_factor"] == 2.0
+    assert 0 < projection["fixed_runtime_seconds"] < projection["projected_runtime_seconds"]
+    assert projection["projected_output_bytes"] > 0
+    assert spark.read.parquet(str(tmp_path / "dry_run" / TRAINING_DATA_FOLDER)).count() == 4178
+
+
+def test_dry_run_warns_on_a_single_input_file(spark, tmp_path, caplog):
+    projection = dry_run(SAMPLE_DATA_PATH, str(tmp_path / "dry_run"), sample_fraction=0.5)
+
+    assert projection["scale_factor"] == 1.0
+    assert any(record.levelname == "WARNING" and "sample is the full input" in record.getMessage()
+               for record in caplog.records)
+
+
+def test_process_datasets(spark, tmp_path):
+    manifest_path = str(tmp_path / "datasets.json")
+    entries = [
+        {"input": SAMPLE_DATA_PATH, "schema": "abalone", "output": str(tmp_path / "first")},
+        {"input": SAMPLE_DATA_PATH, "schema": "abalone", "output": str(tmp_path / "second"), "columns": ["sex"]},
+    ]
+    with open(manifest_path, "w") as f:
+        json.dump(entries, f)
+
+    results = process_datasets(manifest_path, max_parallel_tables=2)
+
+    assert [result["status"] for result in results] == ["succeeded", "succeeded"]
+    assert spark.read.parquet(str(tmp_path / "second" / TRAINING_DATA_FOLDER)).columns == ["sex"]
+
+
+def test_process_datasets_fails_on_invalid_table(spark, tmp_path):
+    manifest_path = str(tmp_path / "datasets.json")
+    entries = [
+        {"input": SAMPLE_DATA_PATH, "schema": "abalone", "output": str(tmp_path / "first")},
+        {"input": SAMPLE_DATA_PATH, "schema": "unknown", "output": str(tmp_path / "second")},
+    ]
+    with open(manifest_path, "w") as f:
+        json.dump(entries, f)
+
+    with pytest.raises(RuntimeError, match="Failed to process 1 of 2 tables"):
+        process_datasets(manifest_path, max_parallel_tables=2)
+
+
+def test_parse_args_single_table():
+    args = parse_args(["--input_table", "input", "--output_table", "output", "--output_files", "4",
+                       "--input_manifest", "manifest.json.gz", "--input_manifest_max_age", "3600"])
+
+    assert (args.input_table, args.output_table, args.output_files) == ("input", "output", 4)
+    assert (args.input_manifest, args.input_manifest_max_age) == ("manifest.json.gz", 3600)
+    with pytest.raises(SystemExit):
+        parse_args(["--input_table", "input"])
+
+
+def test_parse_args_datasets_manifest_rejects_single_table_arguments():
+    args = parse_args(["--datasets_manifest", "datasets.json", "--max_parallel_tables", "2"])
+
+    assert (args.datasets_manifest, args.max_parallel_tables) == ("datasets.json", 2)
+    for argument in [["--output_files", "4"], ["--inference_output", "inference"], ["--sample_files", "1"]]:
+        with pytest.raises(SystemExit):
+            parse_args(["--datasets_manifest", "datasets.json"] + argument)